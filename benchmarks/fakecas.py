@@ -0,0 +1,171 @@
+""" A local stand-in CAS server for benchmarks.
+
+    Serves login, proxyValidate and proxy like a CAS 2.0 server, calls the
+    proxy callback URL given at validation before responding, and sends
+    single sign out requests for issued service tickets on demand. Users
+    are assigned round robin from a fixed set of usernames at login.
+"""
+
+from urlparse import parse_qsl, urlsplit
+import BaseHTTPServer
+import httplib
+import itertools
+import SocketServer
+import threading
+import urllib
+
+__all__ = ['FakeCAS']
+
+_NS = "xmlns:cas='http://www.yale.edu/tp/cas'"
+_SUCCESS = ("<cas:serviceResponse %s><cas:authenticationSuccess><cas:user>%%s</cas:user>"
+            "<cas:attributes><cas:mail>%%s@example.org</cas:mail></cas:attributes>"
+            "%%s</cas:authenticationSuccess></cas:serviceResponse>" % _NS)
+_FAILURE = ("<cas:serviceResponse %s><cas:authenticationFailure code='INVALID_TICKET'>"
+            "Ticket %%s not recognized</cas:authenticationFailure></cas:serviceResponse>" % _NS)
+_PROXY_SUCCESS = ("<cas:serviceResponse %s><cas:proxySuccess><cas:proxyTicket>%%s"
+                  "</cas:proxyTicket></cas:proxySuccess></cas:serviceResponse>" % _NS)
+_PROXY_FAILURE = ("<cas:serviceResponse %s><cas:proxyFailure code='INVALID_TICKET'>"
+                  "Unknown pgt %%s</cas:proxyFailure></cas:serviceResponse>" % _NS)
+_LOGOUT_REQUEST = ('<samlp:LogoutRequest xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" '
+                   'ID="LR-%s" Version="2.0"><saml:NameID xmlns:saml="urn:oasis:names:tc:SAML:2.0:'
+                   'assertion">%s</saml:NameID><samlp:SessionIndex>%s</samlp:SessionIndex>'
+                   '</samlp:LogoutRequest>')
+
+
+def _get(url):
+    """ Returns (status, headers, body) of a GET request for url """
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    conn = httplib.HTTPConnection(netloc, timeout=30)
+    try:
+        conn.request('GET', path + ('?' + query if query else ''))
+        response = conn.getresponse()
+        return (response.status, dict(response.getheaders()), response.read())
+    finally:
+        conn.close()
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+    def do_GET(self):
+        scheme, netloc, path, query, fragment = urlsplit(self.path)
+        params = dict(parse_qsl(query))
+        cas = self.server.cas
+        endpoint = path.rsplit('/', 1)[-1]
+        if endpoint == 'login':
+            self._respond(302, '', {'Location': cas.login(params['service'])})
+        elif endpoint in ('proxyValidate', 'serviceValidate'):
+            self._respond(200, cas.validate(params))
+        elif endpoint == 'proxy':
+            self._respond(200, cas.proxy(params))
+        else:
+            self._respond(404, 'Not found')
+
+
+    def _respond(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeCAS(object):
+    """ CAS server on 127.0.0.1, at the URL given by the url attribute """
+
+    def __init__(self, port=0, users=100):
+        self.usernames = ['user%d' % i for i in range(users)]
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._tickets = {}
+        self._issued = {}
+        self._pgts = {}
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.cas = self
+        self.url = 'http://127.0.0.1:%d/cas/' % self._server.server_address[1]
+
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+    def stop(self):
+        self._server.shutdown()
+
+
+    def login(self, service):
+        """ Issues a service ticket for service and returns the redirect URL """
+        n = next(self._counter)
+        ticket = 'ST-%d-benchmark' % n
+        username = self.usernames[n % len(self.usernames)]
+        with self._lock:
+            self._tickets[ticket] = (service, username)
+            self._issued[ticket] = service
+        return service + ('&' if '?' in service else '?') + 'ticket=' + ticket
+
+
+    def validate(self, params):
+        ticket = params.get('ticket')
+        with self._lock:
+            service, username = self._tickets.pop(ticket, (None, None))
+        if service is None or service != params.get('service'):
+            return _FAILURE % ticket
+        pgt_element = ''
+        if params.get('pgtUrl'):
+            n = next(self._counter)
+            pgt, iou = 'PGT-%d-benchmark' % n, 'PGTIOU-%d-benchmark' % n
+            pgt_url = params['pgtUrl']
+            status, headers, body = _get(pgt_url + ('&' if '?' in pgt_url else '?') +
+                                         urllib.urlencode({'pgtIou': iou, 'pgtId': pgt}))
+            if status == 200:
+                with self._lock:
+                    self._pgts[pgt] = username
+                pgt_element = '<cas:proxyGrantingTicket>%s</cas:proxyGrantingTicket>' % iou
+        return _SUCCESS % (username, username, pgt_element)
+
+
+    def proxy(self, params):
+        pgt = params.get('pgt')
+        with self._lock:
+            known = pgt in self._pgts
+        if not known or not params.get('targetService'):
+            return _PROXY_FAILURE % pgt
+        return _PROXY_SUCCESS % ('PT-%d-benchmark' % next(self._counter))
+
+
+    def issued_tickets(self):
+        """ Returns the service tickets issued so far """
+        with self._lock:
+            return list(self._issued)
+
+
+    def logout(self, ticket):
+        """ Sends a single sign out request for ticket to its service and
+            returns the HTTP status of the response.
+        """
+        with self._lock:
+            service = self._issued.pop(ticket)
+        body = urllib.urlencode({'logoutRequest': _LOGOUT_REQUEST % (ticket, 'user', ticket)})
+        scheme, netloc, path, query, fragment = urlsplit(service)
+        conn = httplib.HTTPConnection(netloc, timeout=30)
+        try:
+            conn.request('POST', path, body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
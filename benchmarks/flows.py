@@ -0,0 +1,306 @@
+""" Measures throughput and latency of django_cas logins, proxy callbacks,
+    proxy ticket requests, single sign out and purging of session service
+    tickets, against the local stand-in CAS server in fakecas.py.
+
+    A Django project using django_cas is served by a threaded WSGI server and
+    driven by concurrent clients. The project uses a SQLite database in a
+    temporary directory, unless a settings module is given, whose settings
+    (e.g. DATABASES, CACHES, SESSION_ENGINE and CAS_*) override the defaults.
+
+    The scenarios are:
+
+    login             the request presenting the service ticket to the login
+                      view, including validation, the proxy callback and the
+                      wait for it
+    proxy_callback    requests to the proxy callback view
+    proxy_ticket      Tgt.get_proxy_ticket_for_service() for logged in users
+    single_sign_out   single sign out requests for the logged in sessions
+    purge             the purge_session_service_tickets command, for ten
+                      times the number of requests of mappings without sessions,
+                      when tickets are kept in the database
+
+    Usage: python benchmarks/flows.py [options] [scenario ...]
+"""
+
+from optparse import OptionParser
+from urlparse import urljoin, urlsplit
+import httplib
+import logging
+import os
+import Queue
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urllib
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from fakecas import FakeCAS
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+SCENARIOS = ['login', 'proxy_callback', 'proxy_ticket', 'single_sign_out', 'purge']
+
+
+class _AppServer(SocketServer.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _get(url):
+    """ Returns (status, Location header) of a GET request for url """
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    conn = httplib.HTTPConnection(netloc, timeout=30)
+    try:
+        conn.request('GET', path + ('?' + query if query else ''))
+        response = conn.getresponse()
+        response.read()
+        return (response.status, response.getheader('Location'))
+    finally:
+        conn.close()
+
+
+def configure(options, app_url, cas_url, tmpdir):
+    from django.conf import settings
+    values = {
+        'DEBUG': False,
+        'SECRET_KEY': 'benchmark',
+        'DATABASES': {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                  'NAME': os.path.join(tmpdir, 'db.sqlite3'),
+                                  'OPTIONS': {'timeout': 60}}},
+        'INSTALLED_APPS': ['django.contrib.auth', 'django.contrib.contenttypes',
+                           'django.contrib.sessions', 'django_cas'],
+        'MIDDLEWARE_CLASSES': ['django.contrib.sessions.middleware.SessionMiddleware',
+                               'django.contrib.auth.middleware.AuthenticationMiddleware'],
+        'AUTHENTICATION_BACKENDS': ['django_cas.backends.CASBackend'],
+        'TEMPLATE_DIRS': [tmpdir],
+        'CAS_AUTO_CREATE_USERS': True,
+    }
+    if options.settings:
+        module = __import__(options.settings, fromlist=['*'])
+        values.update((name, getattr(module, name)) for name in dir(module) if name.isupper())
+    values.update({
+        'ROOT_URLCONF': __name__,
+        'CAS_SERVER_URL': cas_url,
+        'CAS_PROXY_CALLBACK': urljoin(app_url, '/callback/'),
+    })
+    if 'django_cas' not in values['INSTALLED_APPS']:
+        values['INSTALLED_APPS'] = list(values['INSTALLED_APPS']) + ['django_cas']
+    settings.configure(**values)
+
+    # Error pages must render without the admin templates.
+    for name in ('404.html', '500.html'):
+        with open(os.path.join(tmpdir, name), 'w') as f:
+            f.write(name)
+
+    global urlpatterns
+    from django.conf.urls import patterns
+    urlpatterns = patterns('',
+        (r'^login/$', 'django_cas.views.login'),
+        (r'^logout/$', 'django_cas.views.logout'),
+        (r'^callback/$', 'django_cas.views.proxy_callback'),
+    )
+
+
+def run(op, items, concurrency):
+    """ Calls op for each of items from concurrency threads, op returns the
+        latency to record or raises an exception. Returns (latencies, errors,
+        elapsed seconds).
+    """
+    from django.db import connection
+    queue = Queue.Queue()
+    for item in items:
+        queue.put(item)
+    latencies = []
+    errors = []
+
+    def worker():
+        try:
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    latencies.append(op(item))
+                except Exception as e:
+                    errors.append(e)
+        finally:
+            connection.close()
+
+    started = time.time()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (latencies, errors, time.time() - started)
+
+
+def report(name, result):
+    (latencies, errors, elapsed) = result
+    def percentile(q):
+        return latencies[int(round(q * (len(latencies) - 1)))] * 1000
+    latencies.sort()
+    line = "%-16s %6d ops %5d errors %8.1f ops/s" % (
+        name, len(latencies), len(errors), len(latencies) / elapsed)
+    if latencies:
+        line += "   p50 %7.2f  p90 %7.2f  p99 %7.2f  max %7.2f ms" % (
+            percentile(0.5), percentile(0.9), percentile(0.99), latencies[-1] * 1000)
+    print(line)
+    if errors:
+        print("%16s first error: %r" % ('', errors[0]))
+
+
+def login(app_url):
+    status, location = _get(urljoin(app_url, '/login/'))
+    if status != 302:
+        raise Exception("Login view responded %s" % status)
+    status, location = _get(location)
+    if status != 302:
+        raise Exception("CAS login responded %s" % status)
+    started = time.time()
+    status, location = _get(location)
+    latency = time.time() - started
+    if status != 302 or '/cas/' in location:
+        raise Exception("Ticket validation responded %s %s" % (status, location))
+    return latency
+
+
+def proxy_callback(app_url, n):
+    started = time.time()
+    status, location = _get(urljoin(app_url, '/callback/') + '?' +
+                            urllib.urlencode({'pgtIou': 'PGTIOU-cb-%d' % n, 'pgtId': 'PGT-cb-%d' % n}))
+    latency = time.time() - started
+    if status != 200:
+        raise Exception("Proxy callback responded %s" % status)
+    return latency
+
+
+def proxy_ticket(username, n):
+    from django_cas.models import Tgt
+    started = time.time()
+    Tgt.get_tgt_for_user(username).get_proxy_ticket_for_service('http://service.example.org/%d' % (n % 10))
+    return time.time() - started
+
+
+def single_sign_out(cas, ticket):
+    started = time.time()
+    status = cas.logout(ticket)
+    latency = time.time() - started
+    if status != 200:
+        raise Exception("Single sign out responded %s" % status)
+    return latency
+
+
+def logged_in_usernames(cas):
+    """ Returns the usernames with a ticket granting ticket in the ticket store """
+    from django_cas.models import Tgt
+    from django_cas.stores import get_ticket_store
+    store = get_ticket_store()
+    usernames = []
+    for username in cas.usernames:
+        try:
+            store.get_tgt(username)
+            usernames.append(username)
+        except Tgt.DoesNotExist:
+            pass
+    return usernames
+
+
+def purge(count):
+    from django.core.management import call_command
+    from django_cas.models import SessionServiceTicket
+    from django_cas.stores import ModelTicketStore, get_ticket_store
+    if not isinstance(get_ticket_store(), ModelTicketStore):
+        print("%-16s unsupported, the ticket store is not the database" % 'purge')
+        return
+    SessionServiceTicket.objects.bulk_create(
+        [SessionServiceTicket(service_ticket='ST-purge-%d' % i, session_key=uuid.uuid4().hex)
+         for i in range(count)])
+    started = time.time()
+    call_command('purge_session_service_tickets', verbosity=0)
+    elapsed = time.time() - started
+    remaining = SessionServiceTicket.objects.filter(service_ticket__startswith='ST-purge-').count()
+    errors = [Exception("%d mappings not purged" % remaining)] if remaining else []
+    print("%-16s %6d rows %5d errors %8.1f rows/s   %.2f s" % (
+        'purge', count, len(errors), count / elapsed, elapsed))
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [scenario ...]",
+                          description="Scenarios: " + ", ".join(SCENARIOS) + ", all by default.")
+    parser.add_option('-c', '--concurrency', type='int', default=10,
+                      help="Number of concurrent clients, default 10.")
+    parser.add_option('-n', '--requests', type='int', default=500,
+                      help="Number of requests per scenario, default 500.")
+    parser.add_option('-u', '--users', type='int', default=100,
+                      help="Number of distinct users logging in, default 100.")
+    parser.add_option('--settings', help="Settings module overriding the defaults.")
+    options, scenarios = parser.parse_args()
+    scenarios = scenarios or SCENARIOS
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("Unknown scenario %s" % scenario)
+
+    logging.basicConfig(level=logging.CRITICAL)
+    tmpdir = tempfile.mkdtemp(prefix='django_cas_benchmark')
+    try:
+        cas = FakeCAS(users=options.users)
+        app = _AppServer(('127.0.0.1', 0), _QuietHandler)
+        app_url = 'http://127.0.0.1:%d/' % app.server_address[1]
+        configure(options, app_url, cas.url, tmpdir)
+
+        from django.core.handlers.wsgi import WSGIHandler
+        from django.core.management import call_command
+        call_command('syncdb', interactive=False, verbosity=0)
+        app.set_app(WSGIHandler())
+        thread = threading.Thread(target=app.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cas.start()
+
+        print("%d requests per scenario, concurrency %d, %d users" % (
+            options.requests, options.concurrency, options.users))
+        logins = run(lambda n: login(app_url), range(options.requests), options.concurrency)
+        if 'login' in scenarios:
+            report('login', logins)
+
+        if 'proxy_callback' in scenarios:
+            report('proxy_callback', run(lambda n: proxy_callback(app_url, n),
+                                         range(options.requests), options.concurrency))
+
+        if 'proxy_ticket' in scenarios:
+            usernames = logged_in_usernames(cas)
+            if not usernames:
+                print("%-16s no proxy granting tickets" % 'proxy_ticket')
+            else:
+                report('proxy_ticket', run(lambda n: proxy_ticket(usernames[n % len(usernames)], n),
+                                           range(options.requests), options.concurrency))
+
+        if 'single_sign_out' in scenarios:
+            report('single_sign_out', run(lambda ticket: single_sign_out(cas, ticket),
+                                          cas.issued_tickets(), options.concurrency))
+
+        if 'purge' in scenarios:
+            purge(options.requests * 10)
+
+        from django_cas.transport import get_transport
+        if hasattr(get_transport(), 'close'):
+            get_transport().close()
+        app.shutdown()
+        cas.stop()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
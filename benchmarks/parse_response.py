@@ -0,0 +1,58 @@
+""" Compares django_cas.response with the minidom based parsing it replaced.
+
+    Usage: python benchmarks/parse_response.py [number of attributes] [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from django_cas.response import parse_validation_response
+from xml.dom import minidom
+
+RESPONSE = """<cas:serviceResponse xmlns:cas='http://www.yale.edu/tp/cas'>
+    <cas:authenticationSuccess>
+        <cas:user>username</cas:user>
+        <cas:attributes>
+%s
+        </cas:attributes>
+        <cas:proxyGrantingTicket>PGTIOU-84678-8a9d2sfa23casd</cas:proxyGrantingTicket>
+        <cas:proxies>
+            <cas:proxy>https://proxy2/pgtUrl</cas:proxy>
+            <cas:proxy>https://proxy1/pgtUrl</cas:proxy>
+        </cas:proxies>
+    </cas:authenticationSuccess>
+</cas:serviceResponse>
+"""
+
+ATTRIBUTE = "            <cas:attribute%d>value %d</cas:attribute%d>"
+
+
+def parse_with_minidom(xml):
+    """ The parsing done by CASBackend._verify before django_cas.response """
+    response = minidom.parseString(xml)
+    if response.getElementsByTagName('cas:authenticationFailure'):
+        return (None, None, None)
+    username = response.getElementsByTagName('cas:user')[0].firstChild.nodeValue
+    proxies = []
+    pgt = None
+    if response.getElementsByTagName('cas:proxyGrantingTicket'):
+        proxies = [p.firstChild.nodeValue for p in response.getElementsByTagName('cas:proxy')]
+        pgt = response.getElementsByTagName('cas:proxyGrantingTicket')[0].firstChild.nodeValue
+    return (username, proxies, pgt)
+
+
+def main(attributes=10, iterations=2000):
+    xml = RESPONSE % '\n'.join(ATTRIBUTE % (i, i, i) for i in range(attributes))
+    assert parse_with_minidom(xml)[0] == parse_validation_response(xml).user
+    for name, func in [('minidom', parse_with_minidom),
+                       ('django_cas.response', parse_validation_response)]:
+        best = min(timeit.repeat(lambda: func(xml), number=iterations, repeat=3))
+        print("%-20s %8.1f us per response (%d attributes)"
+              % (name, best / iterations * 1e6, attributes))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,49 @@
+""" Measures the per login overhead of resolving the session store class and
+    checking the session backend, before and after django_cas.conf.
+
+    Usage: python benchmarks/resolution.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from django.conf import settings
+settings.configure(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django_cas.conf import get_backend_path, get_session_store_class
+
+SESSION = {BACKEND_SESSION_KEY: 'django_cas.backends.CASBackend'}
+
+
+def session_store_class_before():
+    session_engine = __import__(name=settings.SESSION_ENGINE, fromlist=['SessionStore'])
+    return getattr(session_engine, 'SessionStore')
+
+
+def is_cas_backend_before(session):
+    backend = session.get(BACKEND_SESSION_KEY)
+    from django_cas.backends import CASBackend
+    return backend == '{0.__module__}.{0.__name__}'.format(CASBackend)
+
+
+def is_cas_backend_after(session):
+    return session.get(BACKEND_SESSION_KEY) == get_backend_path()
+
+
+def main(iterations=100000):
+    cases = [('session store class, before', session_store_class_before),
+             ('session store class, after', get_session_store_class),
+             ('backend check, before', lambda: is_cas_backend_before(SESSION)),
+             ('backend check, after', lambda: is_cas_backend_after(SESSION))]
+    for name, func in cases:
+        func()
+        best = min(timeit.repeat(func, number=iterations, repeat=3))
+        print("%-30s %6.2f us per call" % (name, best / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,73 @@
+""" Compares building of CAS login and service URLs with django_cas.urlbuilder
+    with the per request building it replaced, for a synthetic workload of
+    unauthenticated requests redirected to CAS.
+
+    Usage: python benchmarks/url_building.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from django.conf import settings
+settings.configure(CAS_SERVER_URL='https://cas.example.org/cas/', CAS_GATEWAY=True,
+                   CAS_EXTRA_LOGIN_PARAMS={'locale': 'en'})
+
+from django.contrib import auth
+from django.test.client import RequestFactory
+from django_cas import views
+from urllib import urlencode
+from urlparse import parse_qs, urljoin, urlsplit
+
+REQUESTS = [RequestFactory().get('/accounts/login/', {'next': '/app/page/%d?x=%d' % (i, i)})
+            for i in range(100)]
+
+
+def service_url_before(request, redirect_to):
+    service = views._service(request) + request.path
+    params = {}
+    if settings.CAS_GATEWAY:
+        params.update({settings.CAS_GATEWAY_PARAM: '1'})
+    if redirect_to:
+        params.update({auth.REDIRECT_FIELD_NAME: redirect_to})
+    if not params:
+        return service
+    return ''.join([service, '?' if not '?' in service else '&', urlencode(params)])
+
+
+def login_url_before(service):
+    params = {'service': service}
+    if settings.CAS_RENEW:
+        params.update({'renew': 'true'})
+    elif settings.CAS_GATEWAY:
+        params.update({'gateway': 'true'})
+    if settings.CAS_EXTRA_LOGIN_PARAMS:
+        params.update(settings.CAS_EXTRA_LOGIN_PARAMS)
+    return urljoin(settings.CAS_SERVER_URL, 'login') + '?' + urlencode(params)
+
+
+def redirect_before():
+    for request in REQUESTS:
+        login_url_before(service_url_before(request, views._redirect_url(request)))
+
+
+def redirect_after():
+    for request in REQUESTS:
+        views._login_url(views._service_url(request, views._redirect_url(request)))
+
+
+def main(iterations=200):
+    for request in REQUESTS[:3]:
+        next_page = views._redirect_url(request)
+        before = login_url_before(service_url_before(request, next_page))
+        after = views._login_url(views._service_url(request, next_page))
+        assert parse_qs(urlsplit(before).query) == parse_qs(urlsplit(after).query)
+    for name, func in [('before', redirect_before), ('django_cas.urlbuilder', redirect_after)]:
+        best = min(timeit.repeat(func, number=iterations, repeat=3))
+        print("%-22s %6.2f us per redirect" % (name, best / iterations / len(REQUESTS) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -12,12 +12,44 @@ _DEFAULTS = {
     'CAS_IGNORE_REFERER': False,
     'CAS_LOGOUT_COMPLETELY': True,
     'CAS_SINGLE_SIGN_OUT': True,
+    'CAS_SINGLE_SIGN_OUT_ASYNC': False,
+    'CAS_SINGLE_SIGN_OUT_FAST': False,
     'CAS_REDIRECT_URL': '/',
     'CAS_RETRY_LOGIN': False,
     'CAS_PROXY_CALLBACK': None,
     'CAS_SERVER_URL': None,
     'CAS_AUTO_CREATE_USERS' : False,
-    'CAS_ALLOWED_PROXIES' : []
+    'CAS_USER_CACHE_TIMEOUT': 0,
+    'CAS_USER_ATTRIBUTES': {},
+    'CAS_GROUPS_ATTRIBUTE': None,
+    'CAS_ALLOWED_PROXIES' : [],
+    'CAS_PROTECTED_VIEW_PREFIXES': [],
+    'CAS_PROTECTED_NAMESPACES': [],
+    'CAS_TRANSPORT': 'django_cas.transport.PooledTransport',
+    'CAS_CONNECT_TIMEOUT': 5,
+    'CAS_READ_TIMEOUT': 10,
+    'CAS_POOL_SIZE': 10,
+    'CAS_BREAKER_THRESHOLD': 5,
+    'CAS_BREAKER_RESET_TIMEOUT': 30,
+    'CAS_PGT_WAIT_TIMEOUT': 5,
+    'CAS_PGTIOU_TTL': 2 * 24 * 60 * 60,
+    'CAS_PGTIOU_SWEEP_INTERVAL': 60 * 60,
+    'CAS_COALESCE_ACROSS_PROCESSES': False,
+    'CAS_TICKET_STORE': 'django_cas.stores.ModelTicketStore',
+    'CAS_CACHE_BACKEND': None,
+    'CAS_CACHE_MAX_ENTRIES': 1000,
+    'CAS_VALIDATION_CACHE_TIMEOUT': 0,
+    'CAS_TGT_CACHE_TIMEOUT': 0,
+    'CAS_PROXY_TICKET_POOL_SIZE': 0,
+    'CAS_PROXY_TICKET_MAX_AGE': 5,
+    'CAS_PROXY_TICKET_STALE_MAX_AGE': 0,
+    'CAS_PROXY_CONCURRENCY': 10,
+    'CAS_METRICS': 'django_cas.metrics.MemoryMetrics',
+    'CAS_METRICS_TABLE_SIZES': False,
+    'CAS_ASSERTION_KEY': None,
+    'CAS_ASSERTION_MAX_AGE': 5 * 60,
+    'CAS_ASSERTION_COOKIE_NAME': 'django_cas_assertion',
+    'CAS_ASSERTION_COOKIE_DOMAIN': None,
 }
 
 for key, value in _DEFAULTS.iteritems():
@@ -0,0 +1,125 @@
+""" Django CAS 2.0 signed assertions of successful ticket verifications
+
+    With CAS_ASSERTION_KEY set, a successful login issues a short lived
+    assertion of the verified username, proxies and attributes, signed with
+    HMAC using the key. Sibling services configured with the same key accept
+    the assertion in place of a CAS login, verifying it locally without any
+    call to the CAS server.
+
+    Assertions are revoked by single sign out of the service ticket they were
+    issued for, and by django_cas.signout.sign_out_user(). Revocations are
+    kept in the cache named by CAS_CACHE_BACKEND, which must be shared by the
+    sibling services for them to see each other's revocations. Sessions logged
+    in by an assertion keep a reference to it, see reference(), which the
+    CASMiddleware checks on each request, so that they are signed out when the
+    assertion is revoked.
+"""
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import get_cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django_cas.cache import make_key
+import hashlib
+import logging
+import time
+
+__all__ = ['SESSION_KEY', 'is_revoked', 'issue', 'reference', 'revoke', 'revoke_user', 'verify']
+
+logger = logging.getLogger(__name__)
+
+# The session key of the reference to the assertion a session was logged in by.
+SESSION_KEY = '_cas_assertion'
+
+_SALT = 'django_cas.assertions'
+
+
+def _revocations():
+    """ Returns the cache keeping revocations, which must be shared by all
+        processes of the sibling services for revocations to take effect.
+    """
+    if settings.CAS_CACHE_BACKEND:
+        cache = get_cache(settings.CAS_CACHE_BACKEND)
+        if not isinstance(cache, (DummyCache, LocMemCache)):
+            return cache
+    raise ImproperlyConfigured("CAS_ASSERTION_KEY requires CAS_CACHE_BACKEND to name a cache "
+                               "shared by all processes of the sibling services")
+
+
+def _revocation_timeout():
+    # Long enough for the sessions logged in by revoked assertions to see it.
+    return max(settings.CAS_ASSERTION_MAX_AGE, settings.SESSION_COOKIE_AGE)
+
+
+def _ticket_id(ticket):
+    # Service tickets can be used to sign users out, so only a digest is signed.
+    if isinstance(ticket, unicode):
+        ticket = ticket.encode('utf-8')
+    return hashlib.sha1(ticket).hexdigest()
+
+
+def issue(username, proxies, attributes, ticket):
+    """ Returns a signed assertion that username was authenticated with ticket,
+        through proxies and with attributes, a sequence of (name, value) pairs.
+    """
+    # Fail before issuing assertions which could not be revoked.
+    _revocations()
+    payload = {'u': username,
+               'p': list(proxies or ()),
+               'a': [list(pair) for pair in attributes or ()],
+               'i': int(time.time()),
+               't': _ticket_id(ticket)}
+    return signing.dumps(payload, key=settings.CAS_ASSERTION_KEY, salt=_SALT, compress=True)
+
+
+def verify(assertion):
+    """ Returns a tuple (username, [proxy URLs], [(name, value)]) for a valid
+        assertion, or None if it is forged, expired or revoked.
+    """
+    try:
+        payload = signing.loads(assertion, key=settings.CAS_ASSERTION_KEY, salt=_SALT,
+                                max_age=settings.CAS_ASSERTION_MAX_AGE)
+        username = payload['u']
+        if is_revoked([payload['t'], payload['i'], username]):
+            logger.info("Rejected revoked assertion for user %s", username)
+            return None
+        return (username, payload['p'], [tuple(pair) for pair in payload['a']])
+    except signing.SignatureExpired:
+        logger.debug("Rejected expired assertion")
+    except (signing.BadSignature, KeyError, TypeError, ValueError) as e:
+        logger.warn("Rejected invalid assertion: %s", e)
+    return None
+
+
+def reference(assertion):
+    """ Returns a reference to a verified assertion, to keep in the session
+        logged in by it under SESSION_KEY, see is_revoked().
+    """
+    payload = signing.loads(assertion, key=settings.CAS_ASSERTION_KEY, salt=_SALT)
+    return [payload['t'], payload['i'], payload['u']]
+
+
+def is_revoked(reference):
+    """ Returns True if the assertion referenced, see reference(), was revoked """
+    (ticket_id, issued, username) = reference
+    ticket_key = make_key('assertion.ticket', ticket_id)
+    user_key = make_key('assertion.user', username)
+    revoked = _revocations().get_many([ticket_key, user_key])
+    if revoked.get(ticket_key):
+        return True
+    revoked_before = revoked.get(user_key)
+    return revoked_before is not None and issued <= revoked_before
+
+
+def revoke(ticket):
+    """ Revokes the assertion issued for the service ticket """
+    _revocations().set(make_key('assertion.ticket', _ticket_id(ticket)), True,
+                       _revocation_timeout())
+
+
+def revoke_user(username):
+    """ Revokes all assertions issued for username until now """
+    _revocations().set(make_key('assertion.user', username), int(time.time()),
+                       _revocation_timeout())
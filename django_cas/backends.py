@@ -2,14 +2,16 @@
 
 from django.conf import settings
 from django.contrib.auth.backends import ModelBackend
-from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
 from django_cas.exceptions import CasTicketException
-from django_cas.models import Tgt, PgtIOU
-from urllib import urlencode, urlopen
-from urlparse import urljoin
-from xml.dom import minidom
+from django_cas import assertions, metrics, rendezvous, singleflight
+from django_cas.cache import get_cache, make_key
+from django_cas.response import parse_validation_response
+from django_cas.stores import get_ticket_store
+from django_cas.transport import fetch
+import hashlib
 import logging
-import time
 
 __all__ = ['CASBackend']
 
@@ -18,11 +20,23 @@ logger = logging.getLogger(__name__)
 class CASBackend(ModelBackend):
     """ CAS authentication backend """
 
-    def authenticate(self, ticket, service):
-        """ Verifies CAS ticket and gets or creates User object """
+    def authenticate(self, ticket=None, service=None, assertion=None):
+        """ Verifies CAS ticket, or an assertion signed with CAS_ASSERTION_KEY,
+            and gets or creates User object
+        """
 
-        (username, proxies) = self._verify(ticket, service)
-        if not username:
+        if assertion is not None:
+            if not settings.CAS_ASSERTION_KEY or settings.CAS_RENEW:
+                return None
+            verified = assertions.verify(assertion)
+            if verified is None:
+                return None
+            (username, proxies, attributes) = verified
+        elif ticket and service:
+            (username, proxies, attributes) = self._verify_cached(ticket, service)
+            if not username:
+                return None
+        else:
             return None
         
         if settings.CAS_ALLOWED_PROXIES:
@@ -32,22 +46,141 @@ class CASBackend(ModelBackend):
 
         logger.debug("User '%s' passed authentication by CAS backend", username)
 
-        try:
-            return User.objects.get(username=username)
-        except User.DoesNotExist:
-            if settings.CAS_AUTO_CREATE_USERS:
+        user = self._get_user(username, attributes)
+        if user is not None and ticket and settings.CAS_ASSERTION_KEY:
+            # Handed to the login view, which passes it on in a cookie.
+            user.cas_assertion = assertions.issue(username, proxies, attributes, ticket)
+        return user
+
+
+    def _get_user(self, username, attributes):
+        """ Returns the User with username, created if CAS_AUTO_CREATE_USERS is set,
+            with the attributes mapped by CAS_USER_ATTRIBUTES and CAS_GROUPS_ATTRIBUTE
+            applied.
+
+            A digest of the mapped attributes is cached for CAS_USER_CACHE_TIMEOUT
+            seconds, so that the attributes are only compared with the user, and its
+            groups queried, when they changed since the last login.
+        """
+        (fields, group_names) = self._map_attributes(attributes)
+        if fields or group_names is not None:
+            digest = hashlib.sha1(repr((sorted(fields.items()), group_names))).hexdigest()
+        else:
+            digest = None
+
+        created = False
+        if settings.CAS_AUTO_CREATE_USERS:
+            defaults = dict(fields, password=make_password(None))
+            user, created = User.objects.get_or_create(username=username, defaults=defaults)
+            if created:
                 logger.debug("User '%s' auto created by CAS backend", username)
-                return User.objects.create_user(username)
-            else:
+        else:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
                 logger.error("Failed authentication, user '%s' does not exist", username)
+                return None
+
+        if digest is None:
+            return user
+        timeout = settings.CAS_USER_CACHE_TIMEOUT
+        if timeout:
+            cache = get_cache('user')
+            key = make_key('user', username)
+            if not created and cache.get(key) == digest:
+                metrics.incr('cache.user.hit')
+                return user
+            metrics.incr('cache.user.miss')
+        self._update_user(user, {} if created else fields, group_names)
+        if timeout:
+            cache.set(key, digest, timeout)
+        return user
+
+
+    def _map_attributes(self, attributes):
+        """ Returns a tuple ({user field: value}, [group names] or None) for the
+            CAS attributes, as mapped by CAS_USER_ATTRIBUTES and CAS_GROUPS_ATTRIBUTE.
+        """
+        fields = {}
+        group_names = None
+        mapping = settings.CAS_USER_ATTRIBUTES
+        groups_attribute = settings.CAS_GROUPS_ATTRIBUTE
+        if groups_attribute:
+            group_names = []
+        for name, value in attributes or ():
+            if name == groups_attribute:
+                group_names.append(value)
+            elif name in mapping and mapping[name] not in fields:
+                # The first value of multi valued attributes is used.
+                field = mapping[name]
+                max_length = User._meta.get_field(field).max_length
+                fields[field] = value[:max_length] if max_length else value
+        if group_names is not None:
+            group_names = sorted(set(group_names))
+        return (fields, group_names)
 
-        return None
+
+    def _update_user(self, user, fields, group_names):
+        """ Writes the fields that differ from the user, in one update, and
+            adds and removes groups of the user to match group_names.
+        """
+        changed = dict((field, value) for field, value in fields.items()
+                       if getattr(user, field) != value)
+        if changed:
+            logger.debug("Updating %s of user '%s' from CAS attributes", changed.keys(), user.username)
+            User.objects.filter(pk=user.pk).update(**changed)
+            for field, value in changed.items():
+                setattr(user, field, value)
+
+        if group_names is not None:
+            wanted = set(Group.objects.filter(name__in=group_names).values_list('pk', flat=True))
+            current = set(user.groups.values_list('pk', flat=True))
+            if wanted != current:
+                logger.debug("Updating groups of user '%s' from CAS attributes", user.username)
+                if current - wanted:
+                    user.groups.remove(*(current - wanted))
+                if wanted - current:
+                    user.groups.add(*(wanted - current))
+
+
+    def _verify_cached(self, ticket, service):
+        """ Verifies the ticket like _verify, but answers repeated verifications of
+            the same ticket and service from a cache for CAS_VALIDATION_CACHE_TIMEOUT
+            seconds. Only successful verifications are cached.
+        """
+        timeout = settings.CAS_VALIDATION_CACHE_TIMEOUT
+        if not timeout:
+            return self._verify_once(ticket, service)
+
+        cache = get_cache('validation')
+        key = make_key('validation', ticket, service)
+        result = cache.get(key)
+        if result is not None:
+            logger.debug("Using cached verification of ticket %s", ticket)
+            metrics.incr('cache.validation.hit')
+            return result
+
+        metrics.incr('cache.validation.miss')
+        result = self._verify_once(ticket, service)
+        if result[0]:
+            cache.set(key, result, timeout)
+        return result
+
+    
+    def _verify_once(self, ticket, service):
+        """ Verifies the ticket like _verify, sharing the result between concurrent
+            verifications of the same ticket and service, so that only one of them
+            calls the CAS server and waits for the proxy callback.
+        """
+        return singleflight.coalesce(make_key('verify', ticket, service),
+                                     lambda: self._verify(ticket, service))
 
     
     def _verify(self, ticket, service):
         """ Verifies CAS 2.0+ XML-based authentication ticket.
     
-            Returns tuple (username, [proxy URLs]) on success or None on failure.
+            Returns tuple (username, [proxy URLs], [(attribute name, value)]) on
+            success or (None, None, None) on failure.
         """
         params = {'ticket': ticket, 'service': service}
         if settings.CAS_PROXY_CALLBACK:
@@ -55,55 +188,50 @@ class CASBackend(ModelBackend):
         if settings.CAS_RENEW:
             params.update({'renew': 'true'})
     
-        page = urlopen(urljoin(settings.CAS_SERVER_URL, 'proxyValidate') + '?' + urlencode(params))
+        page = fetch('proxyValidate', params)
     
         try:
-            response = minidom.parseString(page.read())
-            if response.getElementsByTagName('cas:authenticationFailure'):
-                logger.warn("Authentication failed from CAS server: %s", 
-                            response.getElementsByTagName('cas:authenticationFailure')[0].firstChild.nodeValue)
-                return (None, None)
+            with metrics.timer('parse.validation'):
+                response = parse_validation_response(page)
+            if not response.user:
+                logger.warn("Authentication failed from CAS server: %s", response.failure_message)
+                metrics.incr('verify.failure')
+                return (None, None, None)
     
-            username = response.getElementsByTagName('cas:user')[0].firstChild.nodeValue
-            proxies = []
-            if response.getElementsByTagName('cas:proxyGrantingTicket'):
-                proxies = [p.firstChild.nodeValue for p in response.getElementsByTagName('cas:proxies')]
-                pgt = response.getElementsByTagName('cas:proxyGrantingTicket')[0].firstChild.nodeValue
+            username = response.user
+            proxies = list(response.proxies)
+            if response.pgt_iou:
                 try:
-                    pgtIou = self._get_pgtiou(pgt)
-                    tgt = Tgt.objects.get(username = username)
-                    tgt.tgt = pgtIou.tgt
-                    tgt.save()
-                    pgtIou.delete()
-                except Tgt.DoesNotExist:
-                    Tgt.objects.create(username = username, tgt = pgtIou.tgt)
-                    pgtIou.delete()
+                    self._consume_pgtiou(response.pgt_iou, username)
                 except:
                     logger.error("Failed to do proxy authentication.", exc_info=True)
     
             logger.debug("Cas proxy authentication succeeded for %s with proxies %s", username, proxies)
-            return (username, proxies)
+            metrics.incr('verify.success')
+            return (username, proxies, list(response.attributes))
         except Exception as e:
-            logger.error("Failed to verify CAS authentication", e)
-            return (None, None)
-        finally:
-            page.close()
+            logger.error("Failed to verify CAS authentication: %s", e)
+            metrics.incr('verify.error')
+            return (None, None, None)
 
 
-    def _get_pgtiou(self, pgt):
-        """ Returns a PgtIOU object given a pgt. 
+    def _consume_pgtiou(self, pgt, username):
+        """ Stores the proxy granting ticket (tgt) given by a pgtIou for username,
+            consuming the pgtIou, and returns the ticket.
         
             The PgtIOU (tgt) is set by the CAS server in a different request that has 
-            completed before this call, however, it may not be found in the database 
-            by this calling thread, hence the attempt to get the ticket is retried 
-            for up to 5 seconds. This should be handled some better way. 
+            completed before this call, however, it may not be found in the ticket store
+            by this calling thread yet. The proxy callback notifies waiting threads
+            through django_cas.rendezvous when the ticket is stored, so this waits
+            for up to CAS_PGT_WAIT_TIMEOUT seconds for that to happen.
         """
-        pgtIou = None
-        retries_left = 5
-        while not pgtIou and retries_left:
-            try:
-                return PgtIOU.objects.get(pgtIou=pgt)
-            except PgtIOU.DoesNotExist:
-                time.sleep(1)
-                retries_left -= 1
-        raise CasTicketException("Could not find pgtIou for pgt %s" % pgt)
+        store = get_ticket_store()
+        def lookup():
+            metrics.incr('pgt.lookups')
+            return store.consume_pgtiou(pgt, username)
+        with metrics.timer('pgt.wait'):
+            tgt = rendezvous.wait(pgt, lookup, settings.CAS_PGT_WAIT_TIMEOUT)
+        if tgt is None:
+            metrics.incr('pgt.timeouts')
+            raise CasTicketException("Could not find pgtIou for pgt %s" % pgt)
+        return tgt
@@ -0,0 +1,81 @@
+""" Django CAS 2.0 caching of short lived results
+
+    Results are cached in the Django cache named by CAS_CACHE_BACKEND, or in
+    a bounded in-process LRU cache if it is None.
+"""
+
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import get_cache as get_django_cache
+import hashlib
+import threading
+import time
+
+__all__ = ['LocalCache', 'get_cache', 'make_key']
+
+
+class LocalCache(object):
+    """ Thread safe, bounded in-process LRU cache with per entry expiry.
+
+        Implements the part of the Django cache API used by django_cas.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            self._data[key] = (expires, value)
+            return value
+
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_caches = {}
+_local_caches_lock = threading.Lock()
+
+def get_cache(name):
+    """ Returns the cache to use for django_cas results of the kind name, e.g. 'validation' """
+    if settings.CAS_CACHE_BACKEND:
+        return get_django_cache(settings.CAS_CACHE_BACKEND)
+    with _local_caches_lock:
+        if name not in _local_caches:
+            _local_caches[name] = LocalCache(settings.CAS_CACHE_MAX_ENTRIES)
+        return _local_caches[name]
+
+
+def make_key(name, *parts):
+    """ Returns a cache key, safe for all cache backends, for name and parts """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        digest.update(part)
+        digest.update('\0')
+    return 'django_cas.%s.%s' % (name, digest.hexdigest())
@@ -0,0 +1,63 @@
+""" Django CAS 2.0 resolution of settings
+
+    Objects derived from settings, such as the session store class, the
+    configured transport and ticket store, are resolved once per process
+    rather than on every request. The resolved objects are discarded when
+    Django signals that settings changed, e.g. by override_settings in tests.
+"""
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils.importlib import import_module
+import threading
+
+__all__ = ['get_backend_path', 'get_session_engine', 'get_session_store_class',
+           'import_by_path', 'resolve']
+
+_lock = threading.RLock()
+_resolved = {}
+
+
+def resolve(name, factory):
+    """ Returns the object resolved under name, calling factory to create it
+        the first time, or the first time after settings changed.
+    """
+    try:
+        return _resolved[name]
+    except KeyError:
+        with _lock:
+            if name not in _resolved:
+                _resolved[name] = factory()
+            return _resolved[name]
+
+
+def import_by_path(path):
+    """ Returns the attribute given by a dotted path, e.g. 'django_cas.stores.ModelTicketStore' """
+    module, attr = path.rsplit('.', 1)
+    return getattr(import_module(module), attr)
+
+
+def get_session_engine():
+    """ Returns the session engine module configured by SESSION_ENGINE """
+    return resolve('session_engine', lambda: import_module(settings.SESSION_ENGINE))
+
+
+def get_session_store_class():
+    """ Returns the SessionStore class of the configured session engine """
+    return get_session_engine().SessionStore
+
+
+def get_backend_path():
+    """ Returns the path of CASBackend as stored in sessions by Django """
+    def backend_path():
+        from django_cas.backends import CASBackend
+        return '{0.__module__}.{0.__name__}'.format(CASBackend)
+    return resolve('backend_path', backend_path)
+
+
+@receiver(setting_changed)
+def clear_resolved(**kwargs):
+    """ Discards everything resolved when settings change """
+    with _lock:
+        _resolved.clear()
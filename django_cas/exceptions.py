@@ -6,3 +6,15 @@ class CasTicketException(Exception):
     
     def __str__(self):
         return repr(self.error)
+
+
+class CasServerUnavailable(Exception):
+    """ Raised instead of calling the CAS server while the circuit breaker
+        is open, retry_after is the number of seconds until it is probed again.
+    """
+    def __init__(self, error, retry_after=0):
+        self.error = error
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return repr(self.error)
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management.base import NoArgsCommand
+from django_cas.conf import get_session_store_class
+from django_cas.models import SessionServiceTicket
+from optparse import make_option
+
+class Command(NoArgsCommand):
+    help = ("Sets the username of CAS session - service ticket mappings created before "
+            "usernames were stored, from the user of the mapped session.")
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+                    help="Number of mappings updated per batch, default 1000."),
+    )
+
+    def handle_noargs(self, **options):
+        """Stores the usernames of Session Service Tickets without one."""
+
+        verbosity = int(options.get('verbosity', 1))
+        batch_size = options.get('batch_size') or 1000
+        checked = updated = 0
+        last_pk = None
+        while True:
+            mappings = SessionServiceTicket.objects.filter(username='').order_by('pk')
+            if last_pk is not None:
+                mappings = mappings.filter(pk__gt=last_pk)
+            batch = list(mappings.values_list('pk', 'session_key')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            user_ids = self._user_ids(set(session_key for (pk, session_key) in batch))
+            usernames = dict(User.objects.filter(pk__in=set(user_ids.values()))
+                                         .values_list('pk', 'username'))
+            pks_by_username = {}
+            for (pk, session_key) in batch:
+                username = usernames.get(user_ids.get(session_key))
+                if username:
+                    pks_by_username.setdefault(username, []).append(pk)
+            for username, pks in pks_by_username.items():
+                SessionServiceTicket.objects.filter(pk__in=pks).update(username=username)
+                updated += len(pks)
+            checked += len(batch)
+
+        if verbosity >= 2:
+            self.stdout.write("Stored usernames of %d of %d session service tickets\n"
+                              % (updated, checked))
+
+
+    def _user_ids(self, session_keys):
+        """ Returns a dictionary mapping those of session_keys with existing
+            authenticated sessions to the user id of the session.
+        """
+        if settings.SESSION_ENGINE in ('django.contrib.sessions.backends.db',
+                                       'django.contrib.sessions.backends.cached_db'):
+            sessions = Session.objects.filter(session_key__in=session_keys)
+            data = ((session.session_key, session.get_decoded()) for session in sessions)
+        else:
+            # Loading a missing session creates a new one in some engines.
+            SessionStore = get_session_store_class()
+            stores = ((key, SessionStore(session_key=key)) for key in session_keys)
+            data = ((key, store.load()) for key, store in stores if store.exists(key))
+        return dict((key, session_data[SESSION_KEY])
+                    for key, session_data in data if SESSION_KEY in session_data)
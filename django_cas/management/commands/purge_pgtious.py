@@ -0,0 +1,18 @@
+from django.core.management.base import NoArgsCommand
+from django_cas.models import PgtIOU
+from optparse import make_option
+
+class Command(NoArgsCommand):
+    help = "Purges CAS proxy ticket IOUs older than CAS_PGTIOU_TTL seconds."
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+                    help="Number of tickets deleted per query, default 1000."),
+    )
+
+    def handle_noargs(self, **options):
+        """Purges expired proxy ticket IOUs."""
+
+        deleted = PgtIOU.delete_expired(options.get('batch_size') or 1000)
+        if int(options.get('verbosity', 1)) >= 2:
+            self.stdout.write("Purged %d proxy ticket IOUs\n" % deleted)
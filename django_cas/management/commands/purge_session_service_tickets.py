@@ -1,19 +1,108 @@
 from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import get_cache
 from django.core.management.base import NoArgsCommand
+from django_cas.conf import get_session_store_class
 from django_cas.models import SessionServiceTicket
+from django_cas.stores import ModelTicketStore, get_ticket_store
+from optparse import make_option
+import time
 
 class Command(NoArgsCommand):
     help = "Purges CAS session - service ticket mappings not matching any session."
-    
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+                    help="Number of mappings checked and deleted per query, default 1000."),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help="Report the mappings that would be purged without deleting them."),
+        make_option('--expired', action='store_true', dest='expired', default=False,
+                    help="Purge mappings older than SESSION_COOKIE_AGE, checking only the expiry "
+                         "of database sessions."),
+    )
+
     def handle_noargs(self, **options):
         """Purges Session Service Tickets with non-existing session keys."""
 
-        verbose = True if options.get('verbosity') in ['2','3'] else False
-        session_engine = __import__(name=settings.SESSION_ENGINE, fromlist=['SessionStore'])
-        SessionStore = getattr(session_engine, 'SessionStore')
-        s = SessionStore()
-        for sst in SessionServiceTicket.objects.all():
-            if not s.exists(sst.session_key):
-                if verbose:
-                    print "deleting session service ticket for session: " + sst.session_key
-                sst.delete()
+        if not isinstance(get_ticket_store(), ModelTicketStore):
+            self.stdout.write("The ticket store is not the database, nothing to purge.\n")
+            return
+
+        verbosity = int(options.get('verbosity', 1))
+        batch_size = options.get('batch_size') or 1000
+        dry_run = options.get('dry_run')
+        if options.get('expired'):
+            return self._purge_expired(batch_size, dry_run, verbosity)
+        existing_sessions = self._existing_sessions_function()
+
+        started = time.time()
+        checked = purged = 0
+        last_pk = None
+        while True:
+            mappings = SessionServiceTicket.objects.order_by('pk')
+            if last_pk is not None:
+                mappings = mappings.filter(pk__gt=last_pk)
+            batch = list(mappings.values_list('pk', 'session_key')[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            existing = existing_sessions(set(session_key for (pk, session_key) in batch))
+            stale = [pk for (pk, session_key) in batch if session_key not in existing]
+            if stale and not dry_run:
+                SessionServiceTicket.objects.filter(pk__in=stale).delete()
+
+            checked += len(batch)
+            purged += len(stale)
+            if verbosity >= 3:
+                for (pk, session_key) in batch:
+                    if session_key not in existing:
+                        self.stdout.write("deleting session service ticket for session: %s\n" % session_key)
+            if verbosity >= 2:
+                self.stdout.write("checked %d, purged %d mappings (%.0f mappings/s)\n"
+                                  % (checked, purged, checked / max(time.time() - started, 0.001)))
+
+        if verbosity >= 2 or dry_run:
+            self.stdout.write("%s %d of %d session service tickets in %.1f s\n"
+                              % ('Would purge' if dry_run else 'Purged', purged, checked,
+                                 time.time() - started))
+
+
+    def _purge_expired(self, batch_size, dry_run, verbosity):
+        """ Purges mappings older than the session life time, in bulk """
+        started = time.time()
+        if dry_run:
+            purged = sum(len(expired) for expired in SessionServiceTicket.expired_batches(batch_size))
+        else:
+            purged = SessionServiceTicket.delete_expired(batch_size)
+        if verbosity >= 2 or dry_run:
+            self.stdout.write("%s %d expired session service tickets in %.1f s\n"
+                              % ('Would purge' if dry_run else 'Purged', purged,
+                                 time.time() - started))
+
+
+    def _existing_sessions_function(self):
+        """ Returns a function taking a set of session keys and returning the
+            subset of those with existing sessions, checked in bulk where the
+            session engine allows it.
+        """
+        engine = settings.SESSION_ENGINE
+        if engine in ('django.contrib.sessions.backends.db',
+                      'django.contrib.sessions.backends.cached_db'):
+            def existing_sessions(session_keys):
+                return set(Session.objects.filter(session_key__in=session_keys)
+                                          .values_list('session_key', flat=True))
+            return existing_sessions
+
+        if engine == 'django.contrib.sessions.backends.cache':
+            from django.contrib.sessions.backends.cache import KEY_PREFIX
+            cache = get_cache(getattr(settings, 'SESSION_CACHE_ALIAS', 'default'))
+            def existing_sessions(session_keys):
+                found = cache.get_many([KEY_PREFIX + key for key in session_keys])
+                return set(key[len(KEY_PREFIX):] for key in found)
+            return existing_sessions
+
+        s = get_session_store_class()()
+        def existing_sessions(session_keys):
+            return set(key for key in session_keys if s.exists(key))
+        return existing_sessions
@@ -0,0 +1,185 @@
+""" Django CAS 2.0 instrumentation
+
+    django_cas reports timings and counters of calls to the CAS server,
+    response parsing, proxy granting ticket waits, cache lookups and single
+    sign out to the metrics sink configured by CAS_METRICS. A sink is any
+    object with the methods incr(name, count=1), timing(name, milliseconds)
+    and gauge(name, value), which is the interface of statsd clients.
+
+    The default MemoryMetrics sink keeps the metrics of each process in memory
+    and renders them in the Prometheus text format, see the metrics view.
+"""
+
+from collections import defaultdict
+from django.conf import settings
+from django_cas.conf import import_by_path, resolve
+import bisect
+import re
+import threading
+import time
+
+__all__ = ['MemoryMetrics', 'NullMetrics', 'gauge', 'get_metrics', 'incr',
+           'record_table_sizes', 'timer', 'timing']
+
+# Upper bounds in milliseconds of the buckets of timing histograms.
+_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class NullMetrics(object):
+    """ Metrics sink discarding everything """
+
+    def incr(self, name, count=1):
+        pass
+
+
+    def timing(self, name, milliseconds):
+        pass
+
+
+    def gauge(self, name, value):
+        pass
+
+
+class MemoryMetrics(object):
+    """ Thread safe metrics sink keeping counters, gauges and histograms of
+        timings in memory.
+    """
+
+    def __init__(self, prefix='django_cas'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._timings = {}
+
+
+    def incr(self, name, count=1):
+        with self._lock:
+            self._counters[name] += count
+
+
+    def timing(self, name, milliseconds):
+        index = bisect.bisect_left(_BUCKETS, milliseconds)
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                # [count, sum, max, count per bucket]
+                timing = self._timings[name] = [0, 0.0, 0.0, [0] * (len(_BUCKETS) + 1)]
+            timing[0] += 1
+            timing[1] += milliseconds
+            timing[2] = max(timing[2], milliseconds)
+            timing[3][index] += 1
+
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+
+    def snapshot(self):
+        """ Returns a dictionary with the current 'counters', 'gauges' and
+            'timings', the latter as dictionaries with 'count', 'sum' and 'max'
+            in milliseconds.
+        """
+        with self._lock:
+            return {'counters': dict(self._counters),
+                    'gauges': dict(self._gauges),
+                    'timings': dict((name, {'count': t[0], 'sum': t[1], 'max': t[2]})
+                                    for name, t in self._timings.items())}
+
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text exposition format,
+            with timings as histograms in seconds.
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            timings = sorted((name, (t[0], t[1], list(t[3]))) for name, t in self._timings.items())
+
+        lines = []
+        for name, value in counters:
+            name = self._name(name) + '_total'
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %s' % (name, value))
+        for name, value in gauges:
+            name = self._name(name)
+            lines.append('# TYPE %s gauge' % name)
+            lines.append('%s %s' % (name, value))
+        for name, (count, total, buckets) in timings:
+            name = self._name(name) + '_seconds'
+            lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, n in zip(_BUCKETS, buckets):
+                cumulative += n
+                lines.append('%s_bucket{le="%g"} %d' % (name, bound / 1000.0, cumulative))
+            lines.append('%s_bucket{le="+Inf"} %d' % (name, count))
+            lines.append('%s_sum %r' % (name, total / 1000.0))
+            lines.append('%s_count %d' % (name, count))
+        return '\n'.join(lines) + '\n'
+
+
+    def _name(self, name):
+        return re.sub('[^a-zA-Z0-9_]', '_', '%s_%s' % (self.prefix, name))
+
+
+def get_metrics():
+    """ Returns the metrics sink configured by CAS_METRICS, shared by the process """
+    def create_metrics():
+        if not settings.CAS_METRICS:
+            return NullMetrics()
+        return import_by_path(settings.CAS_METRICS)()
+    return resolve('metrics', create_metrics)
+
+
+def incr(name, count=1):
+    """ Increments the counter name """
+    get_metrics().incr(name, count)
+
+
+def timing(name, seconds):
+    """ Records a timing of seconds for name """
+    get_metrics().timing(name, seconds * 1000.0)
+
+
+def gauge(name, value):
+    """ Sets the gauge name to value """
+    get_metrics().gauge(name, value)
+
+
+class timer(object):
+    """ Context manager recording the time spent in its block as a timing """
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.time() - self.start
+        timing(self.name, self.elapsed)
+
+
+def record_table_sizes():
+    """ Sets the gauges 'table.pgtiou', 'table.tgt' and 'table.session_service_ticket'
+        to the number of rows of the ticket tables, when tickets are kept in the
+        database.
+    """
+    from django_cas.models import PgtIOU, SessionServiceTicket, Tgt
+    from django_cas.stores import ModelTicketStore, get_ticket_store
+    if not isinstance(get_ticket_store(), ModelTicketStore):
+        return
+    gauge('table.pgtiou', PgtIOU.objects.count())
+    gauge('table.tgt', Tgt.objects.count())
+    gauge('table.session_service_ticket', SessionServiceTicket.objects.count())
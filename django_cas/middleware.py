@@ -5,17 +5,53 @@ from django.contrib import auth
 from django.contrib.auth.views import login, logout
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseRedirect
-from django_cas.exceptions import CasTicketException
-from django_cas.views import login as cas_login, logout as cas_logout
-from urllib import urlencode
+from django_cas import assertions
+from django_cas.conf import resolve
+from django_cas.exceptions import CasServerUnavailable, CasTicketException
+from django_cas.urlbuilder import get_url_builder
+from django_cas.views import login as cas_login, logout as cas_logout, service_unavailable
 
 __all__ = ['CASMiddleware']
 
+# Classification of views by process_view.
+_UNPROTECTED, _LOGIN, _LOGOUT, _ADMIN, _PROTECTED = range(5)
+
+
+def _classify(view_func):
+    """ Returns the classification of view_func """
+    if view_func == login:
+        return _LOGIN
+    if view_func == logout:
+        return _LOGOUT
+    module = getattr(view_func, '__module__', None) or ''
+    if module.startswith('django.contrib.admin.'):
+        return _ADMIN
+    for prefix in settings.CAS_PROTECTED_VIEW_PREFIXES:
+        if module.startswith(prefix):
+            return _PROTECTED
+    return _UNPROTECTED
+
+
 class CASMiddleware(object):
-    """Middleware that allows CAS authentication on admin pages"""
+    """Middleware that allows CAS authentication on admin pages
+
+       Works both as an old style middleware in MIDDLEWARE_CLASSES and as
+       a new style middleware in MIDDLEWARE.
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+
+    def __call__(self, request):
+        self.process_request(request)
+        return self.get_response(request)
+
 
     def process_request(self, request):
-        """ Checks that the authentication middleware is installed. """
+        """ Checks that the authentication middleware is installed, and logs
+            out sessions logged in by an assertion that has been revoked.
+        """
 
         error = ("The Django CAS middleware requires authentication "
                  "middleware to be installed. Edit your MIDDLEWARE_CLASSES "
@@ -23,36 +59,62 @@ class CASMiddleware(object):
                  "AuthenticationMiddleware'.")
         assert hasattr(request, 'user'), error
 
+        if settings.CAS_ASSERTION_KEY:
+            reference = request.session.get(assertions.SESSION_KEY)
+            if reference is not None and assertions.is_revoked(reference):
+                auth.logout(request)
+
 
     def process_view(self, request, view_func, view_args, view_kwargs):
-        """ Forwards unauthenticated requests to the admin page to the CAS
-            login URL, as well as calls to django.contrib.auth.views.login and
-            logout.
+        """ Forwards unauthenticated requests to the admin page, and to views
+            protected by CAS_PROTECTED_VIEW_PREFIXES or CAS_PROTECTED_NAMESPACES,
+            to the CAS login URL, as well as calls to django.contrib.auth.views.login
+            and logout.
+
+            Views are classified once, later requests for the same view only
+            cost a dictionary lookup.
         """
-        if view_func == login:
+        classifications = resolve('middleware_classifications', dict)
+        try:
+            classification = classifications[view_func]
+        except KeyError:
+            classification = classifications[view_func] = _classify(view_func)
+        except TypeError:
+            # Unhashable view
+            classification = _classify(view_func)
+
+        if classification == _UNPROTECTED:
+            if not settings.CAS_PROTECTED_NAMESPACES:
+                return None
+            match = getattr(request, 'resolver_match', None)
+            if match is None or match.namespace not in settings.CAS_PROTECTED_NAMESPACES:
+                return None
+            classification = _PROTECTED
+
+        if classification == _LOGIN:
             return cas_login(request, *view_args, **view_kwargs)
-        if view_func == logout:
+        if classification == _LOGOUT:
             return cas_logout(request, *view_args, **view_kwargs)
-        
-        # The rest of this method amends the Django admin authorization wich
-        # will post a username/password dialog to authenticate to django admin.
-        if not view_func.__module__.startswith('django.contrib.admin.'):
-            return None
 
+        # The rest of this method amends the Django admin authorization wich
+        # will post a username/password dialog to authenticate to django admin,
+        # and requires authentication for other protected views.
         if request.user.is_authenticated():
-            if request.user.is_staff:
+            if classification == _PROTECTED or request.user.is_staff:
                 return None
             else:
                 raise PermissionDenied("No staff priviliges")
-        params = urlencode({auth.REDIRECT_FIELD_NAME: request.get_full_path()})        
-        return HttpResponseRedirect(settings.LOGIN_URL + '?' + params)
+        return HttpResponseRedirect(get_url_builder().admin_login_url(request.get_full_path()))
 
 
     def process_exception(self, request, exception):
         """ When we get a CasTicketException it is probably caused by the ticket timing out.
-            So logout and get the same page again."""
+            So logout and get the same page again. A CasServerUnavailable is answered
+            with 503 Service Unavailable."""
         if isinstance(exception, CasTicketException):
             auth.logout(request)
             return HttpResponseRedirect(request.path)
+        elif isinstance(exception, CasServerUnavailable):
+            return service_unavailable(exception)
         else:
             return None
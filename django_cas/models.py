@@ -1,23 +1,29 @@
 """ Django CAS 2.0 authentication models """
 
-from datetime import datetime, timedelta
+from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth import BACKEND_SESSION_KEY
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.contrib.sessions.models import Session
 from django.core.exceptions import ImproperlyConfigured
-from django.db import models
+from django.db import connection, models
 from django.db.models.signals import post_save, post_delete
 from django.dispatch.dispatcher import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
-from django_cas.exceptions import CasTicketException
-from urllib import urlencode, urlopen
-from urlparse import urljoin
-from xml.dom import minidom
+from django_cas import metrics
+from django_cas.cache import get_cache, make_key
+from django_cas.conf import get_backend_path, get_session_store_class
+from django_cas.proxy import get_pool, map_concurrently, request_proxy_ticket
+import logging
+import threading
+import time
 
 __all__ = ['Tgt']
 
+logger = logging.getLogger(__name__)
+
 class Tgt(models.Model):
     """
     Model representing CAS ticket granting tickets. It can be used
@@ -35,14 +41,15 @@ class Tgt(models.Model):
     @classmethod
     def get_tgt_for_user(self, user):
         """
-        Returns the ticket granting ticket stored for a user in the database.
+        Returns the ticket granting ticket stored for a user in the ticket
+        store configured by CAS_TICKET_STORE, by default the database.
 
         The user can be specified as a User object or its Django username.
         Raises Tgt.DoesNotExist if the ticket can't be found.
         """
-        if isinstance(user, User):
-            return Tgt.objects.get(username = user.username)
-        return Tgt.objects.get(username = user)
+        from django_cas.stores import get_ticket_store
+        username = user.username if isinstance(user, User) else user
+        return get_ticket_store().get_tgt(username)
 
 
     def get_proxy_ticket_for_service(self, service):
@@ -51,27 +58,36 @@ class Tgt(models.Model):
         given by the CAS server. This ticket can then be used to authenticate
         to the backend service, typically in a 'ticket' parameter, but may
         be in other manners detailed by the service specification.
+
+        If CAS_PROXY_TICKET_POOL_SIZE is set, the ticket is taken from a pool
+        of tickets fetched ahead of demand when possible.
         """
         if not settings.CAS_PROXY_CALLBACK:
             raise ImproperlyConfigured("No proxy callback set in settings")
 
-        params = {'pgt': self.tgt, 'targetService': service}
-        page = urlopen(urljoin(settings.CAS_SERVER_URL, 'proxy') + '?' + urlencode(params))
+        with metrics.timer('proxy_ticket'):
+            if settings.CAS_PROXY_TICKET_POOL_SIZE:
+                return get_pool().get(self.tgt, service)
+            return request_proxy_ticket(self.tgt, service)
 
-        try:
-            response = minidom.parseString(page.read())
-            if response.getElementsByTagName('cas:proxySuccess'):
-                return response.getElementsByTagName('cas:proxyTicket')[0].firstChild.nodeValue
-            raise CasTicketException("Failed to get proxy ticket")
-        finally:
-            page.close()
+
+    def get_proxy_tickets_for_services(self, services):
+        """
+        Returns a dictionary mapping each of the given services to a proxy
+        ticket as returned by get_proxy_ticket_for_service, or to the exception
+        raised when getting the ticket for that service failed. The tickets
+        are requested concurrently, in up to CAS_PROXY_CONCURRENCY threads.
+        """
+        if not settings.CAS_PROXY_CALLBACK:
+            raise ImproperlyConfigured("No proxy callback set in settings")
+        return map_concurrently(self.get_proxy_ticket_for_service, services)
 
 
 class PgtIOU(models.Model):
     """ Proxy granting ticket and IOU """
     pgtIou = models.CharField(_('proxy ticket IOU'), max_length = 255, unique = True)
     tgt = models.CharField(_('ticket granting ticket'), max_length = 255)
-    timestamp = models.DateTimeField(auto_now = True)
+    timestamp = models.DateTimeField(auto_now = True, db_index = True)
 
     class Meta:
         db_table = 'django_cas_pgtiou'
@@ -79,37 +95,121 @@ class PgtIOU(models.Model):
         verbose_name_plural = _('proxy ticket IOUs')
 
 
+    @classmethod
+    def delete_expired(self, batch_size=1000):
+        """
+        Deletes tickets older than CAS_PGTIOU_TTL seconds, batch_size tickets
+        per query, and returns the number of tickets deleted.
+        """
+        expire = timezone.now() - timedelta(seconds=settings.CAS_PGTIOU_TTL)
+        deleted = 0
+        while True:
+            expired = list(PgtIOU.objects.filter(timestamp__lt=expire)
+                                         .values_list('pk', flat=True)[:batch_size])
+            if not expired:
+                return deleted
+            PgtIOU.objects.filter(pk__in=expired).delete()
+            deleted += len(expired)
+
+
 class SessionServiceTicket(models.Model):
     """ Handles a mapping between the CAS Service Ticket and the session key
         as long as user is connected to an application that uses the CASBackend
-        for authentication
+        for authentication. A ticket is mapped to several sessions when it is
+        used for several logins, since verifications are cached or coalesced.
     """
-    service_ticket = models.CharField(_('service ticket'), max_length=255, primary_key=True)
-    session_key = models.CharField(_('session key'), max_length=40)
+    service_ticket = models.CharField(_('service ticket'), max_length=255)
+    session_key = models.CharField(_('session key'), max_length=40, db_index=True)
+    username = models.CharField(_('username'), max_length=255, blank=True, default='', db_index=True)
+    created = models.DateTimeField(_('created'), default=timezone.now, db_index=True)
 
 
     class Meta:
         db_table = 'django_cas_session_service_ticket'
         verbose_name = _('session service ticket')
         verbose_name_plural = _('session service tickets')
+        unique_together = (('service_ticket', 'session_key'),)
+
+
+    @classmethod
+    def get_session_keys_for_ticket(self, ticket):
+        """ Returns the keys of all sessions mapped to the service ticket """
+        return list(SessionServiceTicket.objects.filter(service_ticket=ticket)
+                                                .values_list('session_key', flat=True))
+
+
+    @classmethod
+    def get_session_keys_for_user(self, username):
+        """ Returns the keys of all mapped sessions of username """
+        return list(SessionServiceTicket.objects.filter(username=username)
+                                                .values_list('session_key', flat=True)
+                                                .distinct())
+
+
+    @classmethod
+    def expired_batches(self, batch_size=1000):
+        """
+        Yields lists of the primary keys of expired mappings, up to batch_size
+        per list. Mappings created more than SESSION_COOKIE_AGE seconds ago are
+        expired, unless their sessions are kept in the database and have not
+        expired, since sessions saved on every request live longer than that.
+        """
+        expire = timezone.now() - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+        check_sessions = settings.SESSION_ENGINE in ('django.contrib.sessions.backends.db',
+                                                     'django.contrib.sessions.backends.cached_db')
+        last_pk = None
+        while True:
+            mappings = SessionServiceTicket.objects.filter(created__lt=expire).order_by('pk')
+            if last_pk is not None:
+                mappings = mappings.filter(pk__gt=last_pk)
+            batch = list(mappings.values_list('pk', 'session_key')[:batch_size])
+            if not batch:
+                return
+            last_pk = batch[-1][0]
+            live = set()
+            if check_sessions:
+                live = set(Session.objects.filter(session_key__in=set(key for (pk, key) in batch),
+                                                  expire_date__gt=timezone.now())
+                                          .values_list('session_key', flat=True))
+            expired = [pk for (pk, session_key) in batch if session_key not in live]
+            if expired:
+                yield expired
+
+
+    @classmethod
+    def delete_expired(self, batch_size=1000):
+        """
+        Deletes expired mappings, see expired_batches(), batch_size mappings
+        per query, and returns the number of mappings deleted.
+        """
+        deleted = 0
+        for expired in SessionServiceTicket.expired_batches(batch_size):
+            SessionServiceTicket.objects.filter(pk__in=expired).delete()
+            deleted += len(expired)
+        return deleted
 
 
     def get_session(self):
         """ Searches the session in store and returns it """
-        session_engine = __import__(name=settings.SESSION_ENGINE, fromlist=['SessionStore'])
-        SessionStore = getattr(session_engine, 'SessionStore')
+        SessionStore = get_session_store_class()
         return SessionStore(session_key=self.session_key)
 
 
     def __unicode__(self):
-        return self.ticket
+        return self.service_ticket
+
+
+@receiver(post_save, sender=Tgt)
+@receiver(post_delete, sender=Tgt)
+def invalidate_cached_tgt(sender, instance, **kwargs):
+    """ Removes a changed or deleted ticket granting ticket from the cache """
+    if settings.CAS_TGT_CACHE_TIMEOUT:
+        get_cache('tgt').delete(make_key('tgt', instance.username))
 
 
 def _is_cas_backend(session):
     """ Checks if the auth backend is CASBackend """
-    backend = session.get(BACKEND_SESSION_KEY)
-    from django_cas.backends import CASBackend
-    return backend == '{0.__module__}.{0.__name__}'.format(CASBackend)
+    return session.get(BACKEND_SESSION_KEY) == get_backend_path()
 
 
 @receiver(user_logged_in)
@@ -119,9 +219,9 @@ def map_service_ticket(sender, **kwargs):
     request = kwargs['request']
     ticket = request.GET.get('ticket')
     if settings.CAS_SINGLE_SIGN_OUT and ticket and _is_cas_backend(request.session):
-        session_key = request.session.session_key
-        SessionServiceTicket.objects.create(service_ticket=ticket,
-                                            session_key=session_key)
+        from django_cas.stores import get_ticket_store
+        get_ticket_store().map_session(ticket, request.session.session_key,
+                                       kwargs['user'].username)
 
 
 @receiver(user_logged_out)
@@ -130,8 +230,8 @@ def delete_service_ticket(sender, **kwargs):
         logged out """
     request = kwargs['request']
     if settings.CAS_SINGLE_SIGN_OUT and _is_cas_backend(request.session):
-        session_key = request.session.session_key
-        SessionServiceTicket.objects.filter(session_key=session_key).delete()
+        from django_cas.stores import get_ticket_store
+        get_ticket_store().unmap_session(request.session.session_key)
 
 
 @receiver(post_delete, sender=Session)
@@ -144,15 +244,35 @@ def delete_old_session_service_tickets(sender, instance, **kwargs):
         if you don't have sessions mapped to the database.
     """
     if settings.CAS_SINGLE_SIGN_OUT:
-        SessionServiceTicket.objects.filter(session_key=instance.session_key).delete()
+        from django_cas.stores import get_ticket_store
+        get_ticket_store().unmap_session(instance.session_key)
 
 
+_last_sweep = 0
+_sweep_lock = threading.Lock()
+
 @receiver(post_save, sender=PgtIOU)
-def delete_old_tickets(**kwargs):
-    """ Delete tickets if they are over 2 days old 
+def sweep_old_tickets(**kwargs):
+    """ Deletes expired tickets in a background thread, at most once every
+        CAS_PGTIOU_SWEEP_INTERVAL seconds per process.
         kwargs = ['raw', 'signal', 'instance', 'sender', 'created']
     """
-    sender = kwargs.get('sender')
-    now = datetime.now()
-    expire = datetime(now.year, now.month, now.day) - timedelta(days=2)
-    sender.objects.filter(timestamp__lt=expire).delete()
+    global _last_sweep
+    if not settings.CAS_PGTIOU_SWEEP_INTERVAL:
+        return
+    with _sweep_lock:
+        now = time.time()
+        if now - _last_sweep < settings.CAS_PGTIOU_SWEEP_INTERVAL:
+            return
+        _last_sweep = now
+
+    def sweep():
+        try:
+            PgtIOU.delete_expired()
+        except Exception:
+            logger.error("Failed to delete expired proxy ticket IOUs", exc_info=True)
+        finally:
+            connection.close()
+    thread = threading.Thread(target=sweep)
+    thread.daemon = True
+    thread.start()
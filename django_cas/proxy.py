@@ -0,0 +1,183 @@
+""" Django CAS 2.0 proxy ticket acquisition """
+
+from collections import deque, OrderedDict
+from django.conf import settings
+from django_cas import metrics
+from django_cas.conf import resolve
+from django_cas.exceptions import CasTicketException
+from django_cas.response import parse_proxy_response
+from django_cas.transport import cas_unavailable, fetch
+from multiprocessing.pool import ThreadPool
+import logging
+import os
+import threading
+import time
+
+__all__ = ['ProxyTicketPool', 'get_pool', 'get_proxy_tickets_for_user', 'map_concurrently',
+           'request_proxy_ticket']
+
+logger = logging.getLogger(__name__)
+
+
+def request_proxy_ticket(pgt, service):
+    """ Requests a new proxy ticket for service from the CAS server using
+        the proxy granting ticket pgt.
+    """
+    page = fetch('proxy', {'pgt': pgt, 'targetService': service})
+    with metrics.timer('parse.proxy'):
+        response = parse_proxy_response(page)
+    if response.ticket:
+        return response.ticket
+    raise CasTicketException("Failed to get proxy ticket: %s" % response.failure_message)
+
+
+class ProxyTicketPool(object):
+    """ Pool of proxy tickets fetched ahead of demand.
+
+        Each time a ticket for a proxy granting ticket and service is handed
+        out, the pool is refilled in the background with up to size tickets
+        for the same pair, so that following requests are served without a
+        call to the CAS server. Tickets are handed out once and are discarded
+        when older than max_age seconds, since the CAS server expires proxy
+        tickets quickly. At most max_keys pairs are pooled, the least recently
+        used pairs are dropped first.
+
+        While the circuit breaker of the CAS server is open, tickets up to
+        stale_max_age seconds old are handed out if it is larger than max_age.
+    """
+
+    def __init__(self, size, max_age, max_keys=1000, stale_max_age=0):
+        self.size = size
+        self.max_age = max_age
+        self.max_keys = max_keys
+        self.stale_max_age = stale_max_age
+        self._lock = threading.Lock()
+        self._tickets = OrderedDict()
+        self._refilling = set()
+
+
+    def get(self, pgt, service):
+        """ Returns a proxy ticket for service, from the pool if possible """
+        key = (pgt, service)
+        unavailable = cas_unavailable()
+        max_age = max(self.max_age, self.stale_max_age) if unavailable else self.max_age
+        ticket = self._pop(key, max_age)
+        if unavailable:
+            # The pool is not refilled while the CAS server is unavailable.
+            return ticket or request_proxy_ticket(pgt, service)
+        if ticket is None:
+            logger.debug("No pooled proxy ticket for service %s", service)
+            metrics.incr('cache.proxy_ticket.miss')
+            ticket = request_proxy_ticket(pgt, service)
+        else:
+            metrics.incr('cache.proxy_ticket.hit')
+        self.prefetch(pgt, service)
+        return ticket
+
+
+    def prefetch(self, pgt, service):
+        """ Starts filling the pool for pgt and service in the background """
+        key = (pgt, service)
+        with self._lock:
+            if key in self._refilling or len(self._tickets.get(key, ())) >= self.size:
+                return
+            self._refilling.add(key)
+        thread = threading.Thread(target=self._refill, args=key)
+        thread.daemon = True
+        thread.start()
+
+
+    def _pop(self, key, max_age):
+        expired = time.time() - max_age
+        with self._lock:
+            tickets = self._tickets.pop(key, None)
+            if tickets is None:
+                return None
+            self._tickets[key] = tickets
+            while tickets:
+                (ticket, fetched) = tickets.popleft()
+                if fetched > expired:
+                    return ticket
+        return None
+
+
+    def _refill(self, pgt, service):
+        key = (pgt, service)
+        try:
+            while True:
+                with self._lock:
+                    tickets = self._tickets.get(key)
+                    if tickets is not None and len(tickets) >= self.size:
+                        return
+                ticket = request_proxy_ticket(pgt, service)
+                with self._lock:
+                    tickets = self._tickets.pop(key, None) or deque()
+                    tickets.append((ticket, time.time()))
+                    self._tickets[key] = tickets
+                    while len(self._tickets) > self.max_keys:
+                        self._tickets.popitem(last=False)
+        except Exception:
+            logger.warn("Failed to prefetch proxy ticket for service %s", service, exc_info=True)
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+
+def get_pool():
+    """ Returns the proxy ticket pool of the process, configured by
+        CAS_PROXY_TICKET_POOL_SIZE, CAS_PROXY_TICKET_MAX_AGE and
+        CAS_PROXY_TICKET_STALE_MAX_AGE.
+    """
+    return resolve('proxy_ticket_pool',
+                   lambda: ProxyTicketPool(settings.CAS_PROXY_TICKET_POOL_SIZE,
+                                           settings.CAS_PROXY_TICKET_MAX_AGE,
+                                           settings.CAS_CACHE_MAX_ENTRIES,
+                                           settings.CAS_PROXY_TICKET_STALE_MAX_AGE))
+
+
+_workers = None
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+def map_concurrently(func, items):
+    """ Calls func for each of items concurrently in a thread pool of
+        CAS_PROXY_CONCURRENCY threads shared by the process.
+
+        Returns a dictionary mapping each item to the result of func, or to
+        the exception raised by func for that item.
+    """
+    global _workers, _workers_pid
+    items = list(OrderedDict.fromkeys(items))
+    if len(items) < 2:
+        workers = None
+    else:
+        with _workers_lock:
+            if _workers is None or _workers_pid != os.getpid():
+                _workers = ThreadPool(settings.CAS_PROXY_CONCURRENCY)
+                _workers_pid = os.getpid()
+            workers = _workers
+
+    def call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            logger.warn("Failed concurrent call for %s: %s", item, e)
+            return e
+
+    if workers is None:
+        results = [call(item) for item in items]
+    else:
+        results = workers.map(call, items)
+    return dict(zip(items, results))
+
+
+def get_proxy_tickets_for_user(user, services):
+    """ Returns a dictionary mapping each of services to a proxy ticket for
+        user, or to the exception raised when getting the ticket failed.
+        Tickets are requested concurrently.
+
+        The user can be specified as a User object or its Django username.
+        Raises Tgt.DoesNotExist if there is no ticket granting ticket for user.
+    """
+    from django_cas.models import Tgt
+    return Tgt.get_tgt_for_user(user).get_proxy_tickets_for_services(services)
@@ -0,0 +1,96 @@
+""" Django CAS 2.0 rendezvous between proxy callbacks and ticket validation
+
+    When validating a service ticket with a proxy callback URL, the CAS server
+    calls the proxy callback with the proxy granting ticket before it responds
+    to the validation request. The callback may however be served by another
+    thread or process than the one validating the ticket, and its result may
+    not yet be visible to the validating thread.
+
+    wait() blocks the validating thread until notify() is called for the same
+    key by the callback. Threads in the same process are woken immediately by
+    an event. With a shared cache named by CAS_CACHE_BACKEND, waiting threads
+    also register in the cache, and notify() sets a flag there for them only
+    when no thread of its own process is waiting, which the waiting threads of
+    other processes poll at short intervals. The lookup is also retried once a
+    second, as a fallback.
+"""
+
+from django.conf import settings
+from django_cas.cache import get_cache, make_key
+import threading
+import time
+
+__all__ = ['notify', 'wait']
+
+# Seconds between polls of the cache for notifications from other processes.
+_POLL_INTERVAL = 0.1
+# Seconds between lookups when no notification has been seen.
+_LOOKUP_INTERVAL = 1.0
+# Initial and maximum seconds between lookups after a notification.
+_MIN_BACKOFF = 0.01
+_MAX_BACKOFF = 0.1
+
+_lock = threading.Lock()
+_events = {}
+
+
+def _get_cache():
+    """ Returns the cache shared with other processes, or None """
+    if settings.CAS_CACHE_BACKEND:
+        return get_cache('rendezvous')
+    return None
+
+
+def notify(key, timeout=60):
+    """ Wakes up threads waiting for key in this and other processes """
+    with _lock:
+        event = _events.get(key)
+    if event is not None:
+        event.set()
+        return
+    cache = _get_cache()
+    if cache is not None and cache.get(make_key('rendezvous.waiting', key)):
+        cache.set(make_key('rendezvous.notified', key), True, timeout)
+
+
+def wait(key, lookup, timeout):
+    """ Calls lookup until it returns something other than None, and returns that,
+        or returns None if timeout seconds passes first.
+
+        lookup is called once immediately and then again as soon as notify is
+        called for key.
+    """
+    deadline = time.time() + timeout
+    with _lock:
+        event = _events.setdefault(key, threading.Event())
+    cache = _get_cache()
+    if cache is not None:
+        cache.set(make_key('rendezvous.waiting', key), True, max(int(timeout), 1))
+    try:
+        backoff = _MIN_BACKOFF
+        next_lookup = 0
+        while True:
+            notified = event.is_set() or (cache is not None and
+                                          cache.get(make_key('rendezvous.notified', key)))
+            now = time.time()
+            if notified or now >= next_lookup:
+                result = lookup()
+                if result is not None:
+                    return result
+                next_lookup = now + _LOOKUP_INTERVAL
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            if notified:
+                # The notifying transaction may not be visible to us yet.
+                time.sleep(min(backoff, remaining))
+                backoff = min(backoff * 2, _MAX_BACKOFF)
+            elif cache is not None:
+                event.wait(min(_POLL_INTERVAL, remaining, next_lookup - time.time()))
+            else:
+                event.wait(min(remaining, next_lookup - time.time()))
+    finally:
+        with _lock:
+            if _events.get(key) is event:
+                del _events[key]
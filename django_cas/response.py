@@ -0,0 +1,119 @@
+""" Django CAS 2.0 parsing of CAS server responses
+
+    Responses are parsed in a single pass with an incremental parser, without
+    building a document tree, and returned as compact immutable tuples.
+"""
+
+from collections import namedtuple
+from io import BytesIO
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+__all__ = ['ValidationResponse', 'ProxyResponse', 'parse_validation_response',
+           'parse_proxy_response', 'parse_logout_request']
+
+
+class ValidationResponse(namedtuple('ValidationResponse',
+                                    'user proxies pgt_iou attributes failure_code failure_message')):
+    """ Result of a serviceValidate or proxyValidate call to the CAS server.
+
+        On success user is the username, proxies a tuple of proxy URLs and
+        attributes a tuple of (name, value) pairs in document order, where
+        multi valued attributes occur once per value. pgt_iou is None unless
+        a proxy granting ticket was issued.
+
+        On failure user is None and failure_code and failure_message hold
+        the reason given by the CAS server.
+    """
+    __slots__ = ()
+
+
+class ProxyResponse(namedtuple('ProxyResponse', 'ticket failure_code failure_message')):
+    """ Result of a proxy call to the CAS server. ticket is None on failure. """
+    __slots__ = ()
+
+
+def _local_name(tag):
+    """ Returns tag without namespace, e.g. 'user' for '{http://www.yale.edu/tp/cas}user' """
+    return tag[tag.find('}') + 1:]
+
+
+def _text(elem):
+    return (elem.text or '').strip()
+
+
+def _iterparse(xml, events=('end',)):
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    return iterparse(BytesIO(xml), events)
+
+
+def parse_validation_response(xml):
+    """ Parses a CAS 2.0 serviceValidate or proxyValidate response """
+    user = pgt_iou = failure_code = failure_message = None
+    proxies = []
+    attributes = []
+    attributes_depth = None
+    depth = 0
+
+    for event, elem in _iterparse(xml, ('start', 'end')):
+        name = _local_name(elem.tag)
+        if event == 'start':
+            depth += 1
+            if name == 'attributes' and attributes_depth is None:
+                attributes_depth = depth
+            continue
+
+        if attributes_depth is not None:
+            if depth == attributes_depth:
+                attributes_depth = None
+            elif depth == attributes_depth + 1:
+                if name == 'attribute' and elem.get('name'):
+                    # Alternative form <cas:attribute name="..." value="..."/>
+                    attributes.append((elem.get('name'), elem.get('value', '')))
+                else:
+                    attributes.append((name, _text(elem)))
+        elif name == 'user':
+            user = _text(elem)
+        elif name == 'proxy':
+            proxies.append(_text(elem))
+        elif name == 'proxyGrantingTicket':
+            pgt_iou = _text(elem)
+        elif name == 'authenticationFailure':
+            failure_code = elem.get('code')
+            failure_message = _text(elem)
+
+        depth -= 1
+        elem.clear()
+
+    if failure_code is not None or failure_message is not None:
+        user = None
+    return ValidationResponse(user or None, tuple(proxies), pgt_iou or None,
+                              tuple(attributes), failure_code, failure_message)
+
+
+def parse_proxy_response(xml):
+    """ Parses a CAS 2.0 proxy response """
+    ticket = failure_code = failure_message = None
+    for event, elem in _iterparse(xml):
+        name = _local_name(elem.tag)
+        if name == 'proxyTicket':
+            ticket = _text(elem)
+        elif name == 'proxyFailure':
+            failure_code = elem.get('code')
+            failure_message = _text(elem)
+        elem.clear()
+    return ProxyResponse(ticket or None, failure_code, failure_message)
+
+
+def parse_logout_request(xml):
+    """ Returns the service ticket (session index) of a SAML logout request
+        sent by the CAS server on single sign out, or None if there is none.
+    """
+    for event, elem in _iterparse(xml):
+        if _local_name(elem.tag) == 'SessionIndex':
+            return _text(elem) or None
+        elem.clear()
+    return None
@@ -0,0 +1,130 @@
+""" Django CAS 2.0 single sign out processing
+
+    Sessions are deleted directly from the session engine by key, without
+    loading the user or going through django.contrib.auth.logout.
+
+    With CAS_SINGLE_SIGN_OUT_ASYNC set, logout requests from the CAS server
+    are acknowledged at once and the sessions are destroyed by a background
+    thread in each process, in batches.
+"""
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import get_cache
+from django.db import connection
+from django_cas import assertions, metrics
+from django_cas.conf import get_session_engine, get_session_store_class
+from django_cas.stores import get_ticket_store
+import logging
+import os
+import Queue
+import threading
+
+__all__ = ['delete_sessions', 'enqueue', 'sign_out_sessions', 'sign_out_tickets', 'sign_out_user']
+
+logger = logging.getLogger(__name__)
+
+# The maximum number of logout requests processed together.
+_BATCH_SIZE = 100
+
+
+def delete_sessions(session_keys):
+    """ Deletes the sessions with the given keys from the session engine,
+        in bulk for the database, cached database and cache session engines.
+    """
+    if not session_keys:
+        return
+    engine = settings.SESSION_ENGINE
+    if engine in ('django.contrib.sessions.backends.cache',
+                  'django.contrib.sessions.backends.cached_db'):
+        prefix = get_session_engine().KEY_PREFIX
+        cache = get_cache(getattr(settings, 'SESSION_CACHE_ALIAS', 'default'))
+        cache.delete_many([prefix + key for key in session_keys])
+    if engine in ('django.contrib.sessions.backends.db',
+                  'django.contrib.sessions.backends.cached_db'):
+        Session.objects.filter(session_key__in=session_keys).delete()
+    elif engine != 'django.contrib.sessions.backends.cache':
+        s = get_session_store_class()()
+        for key in session_keys:
+            s.delete(key)
+
+
+def sign_out_sessions(session_keys):
+    """ Deletes the sessions with the given keys and their service ticket mappings """
+    delete_sessions(session_keys)
+    store = get_ticket_store()
+    for session_key in session_keys:
+        store.unmap_session(session_key)
+
+
+def sign_out_tickets(tickets):
+    """ Destroys the sessions mapped to the given service tickets and returns
+        the number of sessions destroyed.
+    """
+    store = get_ticket_store()
+    session_keys = set()
+    for ticket in tickets:
+        ticket_session_keys = store.get_session_keys(ticket)
+        if not ticket_session_keys:
+            logger.info("No session matching single sign out request: %s", ticket)
+        session_keys.update(ticket_session_keys)
+    sign_out_sessions(list(session_keys))
+    logger.debug("Signed out %d sessions for %d single sign out requests", len(session_keys), len(tickets))
+    metrics.incr('signout.tickets', len(tickets))
+    metrics.incr('signout.sessions', len(session_keys))
+    return len(session_keys)
+
+
+def sign_out_user(username):
+    """ Destroys all sessions of username authenticated by CAS, revokes the
+        assertions issued for the user and returns the number of sessions destroyed.
+    """
+    if settings.CAS_ASSERTION_KEY:
+        assertions.revoke_user(username)
+    session_keys = get_ticket_store().get_session_keys_for_user(username)
+    sign_out_sessions(session_keys)
+    logger.debug("Signed out %d sessions of user %s", len(session_keys), username)
+    return len(session_keys)
+
+
+class _Worker(object):
+    """ Background thread destroying sessions for queued service tickets """
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+
+    def put(self, ticket):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads do not survive fork, start one per process.
+                self._pid = os.getpid()
+                thread = threading.Thread(target=self._run, name='django_cas single sign out')
+                thread.daemon = True
+                thread.start()
+        self.queue.put(ticket)
+
+
+    def _run(self):
+        while True:
+            tickets = [self.queue.get()]
+            while len(tickets) < _BATCH_SIZE:
+                try:
+                    tickets.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                sign_out_tickets(tickets)
+            except Exception:
+                logger.error("Failed to process single sign out requests", exc_info=True)
+            finally:
+                connection.close()
+
+
+_worker = _Worker()
+
+def enqueue(ticket):
+    """ Queues the session mapped to service ticket for destruction """
+    _worker.put(ticket)
@@ -0,0 +1,111 @@
+""" Django CAS 2.0 coalescing of concurrent identical calls
+
+    When several threads make the same call at the same time, e.g. verify the
+    same ticket for the same service on a double submit, only the first calls
+    the CAS server and the others wait for and share its result.
+
+    With CAS_COALESCE_ACROSS_PROCESSES set, calls are also coalesced across
+    processes through a lock in the cache named by CAS_CACHE_BACKEND.
+
+    Only calls whose result may be shared can be coalesced. Proxy tickets are
+    single use, so requests for proxy tickets are never coalesced.
+"""
+
+from django.conf import settings
+from django_cas import metrics
+from django_cas.cache import get_cache
+import math
+import threading
+import time
+
+__all__ = ['SingleFlight', 'coalesce']
+
+# Seconds between polls of the cache for the result of another process.
+_POLL_INTERVAL = 0.05
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Coalesces concurrent calls with the same key within a process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+
+    def do(self, key, func):
+        """ Returns func(), or the result of a call of func with the same key
+            already in flight. Exceptions are shared like results.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr('singleflight.shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def _across_processes(key, func, timeout):
+    """ Returns func(), or the result of another process calling func for key
+        at the same time, shared through the cache for up to timeout seconds.
+    """
+    cache = get_cache('singleflight')
+    lock_key, result_key = key + '.lock', key + '.result'
+    if cache.add(lock_key, True, timeout):
+        try:
+            result = func()
+            cache.set(result_key, (result,), timeout)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        shared = cache.get(result_key)
+        if shared is not None:
+            metrics.incr('singleflight.shared')
+            return shared[0]
+        if cache.get(lock_key) is None and cache.get(result_key) is None:
+            # The other process failed without a result.
+            break
+        time.sleep(_POLL_INTERVAL)
+    return func()
+
+
+_flight = SingleFlight()
+
+def coalesce(key, func):
+    """ Returns func(), sharing the result with concurrent calls for key in
+        the process, and in other processes if CAS_COALESCE_ACROSS_PROCESSES
+        is set. key must be safe for all cache backends, see make_key().
+    """
+    if settings.CAS_COALESCE_ACROSS_PROCESSES and settings.CAS_CACHE_BACKEND:
+        # Long enough for the call to complete, bounded by the CAS timeouts.
+        timeout = (settings.CAS_CONNECT_TIMEOUT or 0) + (settings.CAS_READ_TIMEOUT or 0) + \
+                  settings.CAS_PGT_WAIT_TIMEOUT
+        timeout = max(int(math.ceil(timeout)), 1)
+        return _flight.do(key, lambda: _across_processes(key, func, timeout))
+    return _flight.do(key, func)
@@ -0,0 +1,312 @@
+""" Django CAS 2.0 ticket stores
+
+    The ticket store configured by CAS_TICKET_STORE keeps the proxy granting
+    ticket IOUs, proxy granting tickets and session - service ticket mappings
+    used by django_cas. ModelTicketStore, the default, keeps them in the
+    database tables of the django_cas models. CacheTicketStore keeps them in
+    a Django cache, with expiry times, which avoids database writes on every
+    login, proxy callback and logout for these short lived tickets.
+"""
+
+from django.conf import settings
+from django.core.cache import get_cache as get_django_cache
+from django.db import IntegrityError, connections, router, transaction
+from django_cas import metrics
+from django_cas.cache import get_cache, make_key
+from django_cas.conf import import_by_path, resolve
+from django_cas.models import PgtIOU, SessionServiceTicket, Tgt
+
+__all__ = ['CacheTicketStore', 'ModelTicketStore', 'get_ticket_store']
+
+
+def _atomic(using):
+    """ Returns a context manager running its block in a transaction """
+    if hasattr(transaction, 'atomic'):
+        return transaction.atomic(using=using)
+    return transaction.commit_on_success(using=using)
+
+
+def _pg_version(connection):
+    # The version is read from the connection, which is opened by a cursor.
+    connection.cursor()
+    return connection.pg_version
+
+
+def _sqlite_version_info():
+    # Imported here, since Python may be built without SQLite when it is not used.
+    from django.db.backends.sqlite3.base import Database
+    return Database.sqlite_version_info
+
+
+def _upsert_sql(connection):
+    """ Returns the SQL inserting or updating the Tgt of a username in one
+        statement, taking (username, tgt) parameters, or None if the database
+        does not support it.
+    """
+    qn = connection.ops.quote_name
+    insert = 'INSERT INTO %s (%s, %s) VALUES (%%s, %%s)' % (
+        qn(Tgt._meta.db_table), qn('username'), qn('tgt'))
+    if connection.vendor == 'postgresql' and _pg_version(connection) >= 90500:
+        return insert + ' ON CONFLICT (%s) DO UPDATE SET %s = EXCLUDED.%s' % (
+            qn('username'), qn('tgt'), qn('tgt'))
+    if connection.vendor == 'sqlite' and _sqlite_version_info() >= (3, 24):
+        return insert + ' ON CONFLICT (%s) DO UPDATE SET %s = excluded.%s' % (
+            qn('username'), qn('tgt'), qn('tgt'))
+    if connection.vendor == 'mysql':
+        return insert + ' ON DUPLICATE KEY UPDATE %s = VALUES(%s)' % (qn('tgt'), qn('tgt'))
+    return None
+
+
+def _consume_sql(connection):
+    """ Returns the SQL deleting a PgtIOU and inserting or updating the Tgt of
+        a username with its proxy granting ticket in one statement, taking
+        (pgt_iou, username) parameters and returning the ticket, or None if the
+        database does not support it.
+    """
+    if connection.vendor != 'postgresql' or _pg_version(connection) < 90500:
+        return None
+    qn = connection.ops.quote_name
+    return ('WITH iou AS (DELETE FROM %(pgtiou)s WHERE %(pgtIou)s = %%s RETURNING %(tgt)s) '
+            'INSERT INTO %(table)s (%(username)s, %(tgt)s) SELECT %%s, %(tgt)s FROM iou '
+            'ON CONFLICT (%(username)s) DO UPDATE SET %(tgt)s = EXCLUDED.%(tgt)s '
+            'RETURNING %(tgt)s') % {
+        'pgtiou': qn(PgtIOU._meta.db_table), 'pgtIou': qn('pgtIou'),
+        'table': qn(Tgt._meta.db_table), 'username': qn('username'), 'tgt': qn('tgt')}
+
+
+class ModelTicketStore(object):
+    """ Keeps tickets in the database using the django_cas models """
+
+    def store_pgtiou(self, pgt_iou, tgt):
+        """ Stores the proxy granting ticket tgt for pgt_iou """
+        PgtIOU.objects.create(tgt = tgt, pgtIou = pgt_iou)
+
+
+    def get_pgtiou(self, pgt_iou):
+        """ Returns the proxy granting ticket stored for pgt_iou, or None """
+        try:
+            return PgtIOU.objects.get(pgtIou = pgt_iou).tgt
+        except PgtIOU.DoesNotExist:
+            return None
+
+
+    def delete_pgtiou(self, pgt_iou):
+        PgtIOU.objects.filter(pgtIou = pgt_iou).delete()
+
+
+    def consume_pgtiou(self, pgt_iou, username):
+        """ Deletes pgt_iou and stores its proxy granting ticket as the Tgt of
+            username in one transaction, a single statement on PostgreSQL 9.5
+            and later. Returns the ticket, or None if pgt_iou is not stored.
+        """
+        using = router.db_for_write(Tgt)
+        connection = connections[using]
+        sql = _consume_sql(connection)
+        with _atomic(using):
+            if sql is not None:
+                cursor = connection.cursor()
+                cursor.execute(sql, [pgt_iou, username])
+                row = cursor.fetchone()
+                tgt = row[0] if row else None
+            else:
+                try:
+                    tgt = PgtIOU.objects.using(using).get(pgtIou = pgt_iou).tgt
+                except PgtIOU.DoesNotExist:
+                    return None
+                self._upsert_tgt(using, username, tgt)
+                # PgtIOU has no relations, so delete without collecting instances first.
+                qn = connection.ops.quote_name
+                connection.cursor().execute('DELETE FROM %s WHERE %s = %%s' % (
+                    qn(PgtIOU._meta.db_table), qn('pgtIou')), [pgt_iou])
+        if tgt is not None:
+            self._invalidate_tgt(username)
+        return tgt
+
+
+    def get_tgt(self, username):
+        """ Returns the Tgt of username, raises Tgt.DoesNotExist if there is none.
+
+            The ticket is cached for CAS_TGT_CACHE_TIMEOUT seconds if set.
+        """
+        timeout = settings.CAS_TGT_CACHE_TIMEOUT
+        if not timeout:
+            return Tgt.objects.get(username = username)
+
+        cache = get_cache('tgt')
+        key = make_key('tgt', username)
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.incr('cache.tgt.hit')
+            return Tgt(id = cached[0], username = username, tgt = cached[1])
+        metrics.incr('cache.tgt.miss')
+        tgt = Tgt.objects.get(username = username)
+        cache.set(key, (tgt.pk, tgt.tgt), timeout)
+        return tgt
+
+
+    def set_tgt(self, username, tgt):
+        """ Stores the proxy granting ticket tgt for username """
+        using = router.db_for_write(Tgt)
+        with _atomic(using):
+            self._upsert_tgt(using, username, tgt)
+        self._invalidate_tgt(username)
+
+
+    def _upsert_tgt(self, using, username, tgt):
+        """ Inserts or updates the Tgt of username, also when another thread
+            inserts it concurrently.
+        """
+        connection = connections[using]
+        sql = _upsert_sql(connection)
+        if sql is not None:
+            connection.cursor().execute(sql, [username, tgt])
+            return
+        tickets = Tgt.objects.using(using).filter(username = username)
+        if tickets.update(tgt = tgt):
+            return
+        sid = transaction.savepoint(using = using)
+        try:
+            Tgt.objects.using(using).create(username = username, tgt = tgt)
+            transaction.savepoint_commit(sid, using = using)
+        except IntegrityError:
+            # Inserted by a concurrent login of the same user.
+            transaction.savepoint_rollback(sid, using = using)
+            tickets.update(tgt = tgt)
+
+
+    def _invalidate_tgt(self, username):
+        # Updated without saving a model instance, so without the post_save signal.
+        if settings.CAS_TGT_CACHE_TIMEOUT:
+            get_cache('tgt').delete(make_key('tgt', username))
+
+
+    def map_session(self, ticket, session_key, username):
+        """ Maps service ticket to session_key of the session of username """
+        # The same ticket may be used for several logins, each mapped to its own
+        # session, when ticket verifications are cached or coalesced.
+        SessionServiceTicket.objects.get_or_create(service_ticket = ticket, session_key = session_key,
+                                                   defaults = {'username': username})
+
+
+    def get_session_keys(self, ticket):
+        """ Returns the keys of all sessions mapped to service ticket """
+        return SessionServiceTicket.get_session_keys_for_ticket(ticket)
+
+
+    def get_session_keys_for_user(self, username):
+        """ Returns the keys of all mapped sessions of username """
+        return SessionServiceTicket.get_session_keys_for_user(username)
+
+
+    def unmap_session(self, session_key):
+        """ Removes all service tickets mapped to session_key """
+        SessionServiceTicket.objects.filter(session_key = session_key).delete()
+
+
+class CacheTicketStore(object):
+    """ Keeps tickets in the Django cache named by CAS_CACHE_BACKEND, or the
+        default cache, which must be shared by all processes serving the
+        application, e.g. memcached or Redis.
+
+        Proxy granting ticket IOUs expire after CAS_PGTIOU_TTL seconds. Proxy
+        granting tickets and session mappings expire with the session, after
+        SESSION_COOKIE_AGE seconds.
+    """
+
+    def __init__(self):
+        self.cache = get_django_cache(settings.CAS_CACHE_BACKEND or 'default')
+
+
+    def store_pgtiou(self, pgt_iou, tgt):
+        self.cache.set(make_key('pgtiou', pgt_iou), tgt, settings.CAS_PGTIOU_TTL)
+
+
+    def get_pgtiou(self, pgt_iou):
+        return self.cache.get(make_key('pgtiou', pgt_iou))
+
+
+    def delete_pgtiou(self, pgt_iou):
+        self.cache.delete(make_key('pgtiou', pgt_iou))
+
+
+    def consume_pgtiou(self, pgt_iou, username):
+        tgt = self.get_pgtiou(pgt_iou)
+        if tgt is not None:
+            self.set_tgt(username, tgt)
+            self.delete_pgtiou(pgt_iou)
+        return tgt
+
+
+    def get_tgt(self, username):
+        tgt = self.cache.get(make_key('store.tgt', username))
+        if tgt is None:
+            raise Tgt.DoesNotExist("No ticket granting ticket for %s" % username)
+        return Tgt(username = username, tgt = tgt)
+
+
+    def set_tgt(self, username, tgt):
+        self.cache.set(make_key('store.tgt', username), tgt, settings.SESSION_COOKIE_AGE)
+
+
+    def map_session(self, ticket, session_key, username):
+        timeout = settings.SESSION_COOKIE_AGE
+        ticket_entry_key = make_key('store.ticket', ticket)
+        session_entry_key = make_key('store.session', session_key)
+        (mapped_username, tickets) = self.cache.get(session_entry_key) or (username, [])
+        if ticket not in tickets:
+            tickets.append(ticket)
+        # A ticket is mapped to several sessions when used for several logins.
+        ticket_session_keys = self.cache.get(ticket_entry_key) or []
+        if session_key not in ticket_session_keys:
+            ticket_session_keys.append(session_key)
+        if mapped_username != username:
+            # The session was logged in by another user before.
+            self._remove_user_session(mapped_username, session_key)
+        user_entry_key = make_key('store.user', username)
+        session_keys = self.cache.get(user_entry_key) or []
+        if session_key not in session_keys:
+            session_keys.append(session_key)
+        self.cache.set_many({ticket_entry_key: ticket_session_keys,
+                             session_entry_key: (username, tickets),
+                             user_entry_key: session_keys}, timeout)
+
+
+    def get_session_keys(self, ticket):
+        return self.cache.get(make_key('store.ticket', ticket)) or []
+
+
+    def get_session_keys_for_user(self, username):
+        return self.cache.get(make_key('store.user', username)) or []
+
+
+    def unmap_session(self, session_key):
+        timeout = settings.SESSION_COOKIE_AGE
+        session_entry_key = make_key('store.session', session_key)
+        entry = self.cache.get(session_entry_key)
+        if entry is None:
+            return
+        (username, tickets) = entry
+        ticket_entries = self.cache.get_many([make_key('store.ticket', ticket) for ticket in tickets])
+        remaining = {}
+        for ticket_entry_key, ticket_session_keys in ticket_entries.items():
+            ticket_session_keys = [key for key in ticket_session_keys if key != session_key]
+            if ticket_session_keys:
+                remaining[ticket_entry_key] = ticket_session_keys
+        if remaining:
+            self.cache.set_many(remaining, timeout)
+        self.cache.delete_many([key for key in ticket_entries if key not in remaining] +
+                               [session_entry_key])
+        self._remove_user_session(username, session_key)
+
+
+    def _remove_user_session(self, username, session_key):
+        user_entry_key = make_key('store.user', username)
+        session_keys = self.cache.get(user_entry_key) or []
+        if session_key in session_keys:
+            session_keys.remove(session_key)
+            self.cache.set(user_entry_key, session_keys, settings.SESSION_COOKIE_AGE)
+
+
+def get_ticket_store():
+    """ Returns the ticket store configured by CAS_TICKET_STORE """
+    return resolve('ticket_store', lambda: import_by_path(settings.CAS_TICKET_STORE)())
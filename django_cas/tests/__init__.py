@@ -0,0 +1,4 @@
+""" Django CAS 2.0 tests, run by manage.py test django_cas in a project using django_cas """
+
+from django_cas.tests.test_assertions import *
+from django_cas.tests.test_stores import *
@@ -0,0 +1,188 @@
+""" Tests of signed assertions, see django_cas.assertions """
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+from django_cas import assertions
+from django_cas.backends import CASBackend
+import shutil
+import tempfile
+import time
+
+__all__ = ['AssertionTests', 'AssertionLoginTests', 'AssertionConfigurationTests']
+
+_SETTINGS = {
+    'CAS_ASSERTION_KEY': 'assertion key',
+    'CAS_ASSERTION_MAX_AGE': 300,
+    'CAS_CACHE_BACKEND': 'django_cas',
+    'CAS_SERVER_URL': 'https://cas.example.org/',
+    'CAS_RENEW': False,
+    'AUTHENTICATION_BACKENDS': ('django_cas.backends.CASBackend',),
+    'MIDDLEWARE_CLASSES': ('django.contrib.sessions.middleware.SessionMiddleware',
+                           'django.contrib.auth.middleware.AuthenticationMiddleware',
+                           'django_cas.middleware.CASMiddleware'),
+}
+
+
+class _Clock(object):
+    """ Stand-in for the time module, offset seconds ahead """
+
+    def __init__(self, offset):
+        self.offset = offset
+
+
+    def time(self):
+        return time.time() + self.offset
+
+
+class _SharedCacheTestCase(TestCase):
+    """ Runs tests with the settings above and revocations in a file based
+        cache, which is shared like in production.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='django_cas_tests')
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                  'django_cas': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                 'LOCATION': self.cache_dir}}
+        self.settings_override = override_settings(CACHES=caches, **_SETTINGS)
+        self.settings_override.enable()
+
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class AssertionTests(_SharedCacheTestCase):
+
+    def issue(self, username='alice', ticket='ST-1'):
+        return assertions.issue(username, ['https://proxy.example.org/'],
+                                [('mail', 'alice@example.org')], ticket)
+
+
+    def test_verify(self):
+        self.assertEqual(assertions.verify(self.issue()),
+                         ('alice', ['https://proxy.example.org/'], [('mail', 'alice@example.org')]))
+
+
+    def test_tampered_assertion_is_rejected(self):
+        assertion = self.issue()
+        payload, rest = assertion.split(':', 1)
+        forged = signing.dumps({'u': 'mallory', 'p': [], 'a': [], 'i': int(time.time()), 't': 'x'},
+                               key='another key', salt='django_cas.assertions')
+        self.assertEqual(assertions.verify(payload[:-1] + 'A' + ':' + rest), None)
+        self.assertEqual(assertions.verify(assertion[:-2] + 'xx'), None)
+        self.assertEqual(assertions.verify(forged), None)
+        self.assertEqual(assertions.verify('junk'), None)
+
+
+    def test_expired_assertion_is_rejected(self):
+        assertion = self.issue()
+        clock, signing.time = signing.time, _Clock(301)
+        try:
+            self.assertEqual(assertions.verify(assertion), None)
+        finally:
+            signing.time = clock
+
+
+    def test_ticket_revocation(self):
+        assertion = self.issue(ticket='ST-1')
+        other = self.issue(ticket='ST-2')
+        assertions.revoke('ST-1')
+        self.assertEqual(assertions.verify(assertion), None)
+        self.assertNotEqual(assertions.verify(other), None)
+
+
+    def test_user_revocation(self):
+        assertion = self.issue(username='alice')
+        other = self.issue(username='bob')
+        assertions.revoke_user('alice')
+        self.assertEqual(assertions.verify(assertion), None)
+        self.assertNotEqual(assertions.verify(other), None)
+
+
+    def test_refused_with_renew(self):
+        assertion = self.issue()
+        User.objects.create_user('alice')
+        with override_settings(CAS_RENEW=True):
+            self.assertEqual(CASBackend().authenticate(assertion=assertion), None)
+
+
+class AssertionLoginTests(_SharedCacheTestCase):
+    urls = 'django_cas.tests.urls'
+
+    def setUp(self):
+        super(AssertionLoginTests, self).setUp()
+        self.user = User.objects.create_user('alice')
+        self.client = Client()
+        self.client.cookies[settings.CAS_ASSERTION_COOKIE_NAME] = assertions.issue('alice', [], [], 'ST-1')
+
+
+    def test_login(self):
+        response = self.client.get('/login/', {'next': '/next/'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('/next/'))
+        self.assertEqual(self.client.session.get('_auth_user_id'), self.user.pk)
+
+
+    def test_refused_with_renew(self):
+        with override_settings(CAS_RENEW=True):
+            response = self.client.get('/login/', {'next': '/next/'})
+        self.assertTrue(response['Location'].startswith('https://cas.example.org/login'))
+        self.assertEqual(self.client.session.get('_auth_user_id'), None)
+
+
+    def test_middleware_signs_out_revoked_ticket(self):
+        self.client.get('/login/')
+        self.assertEqual(self.client.session.get('_auth_user_id'), self.user.pk)
+        assertions.revoke('ST-1')
+        response = self.client.get('/login/', {'next': '/next/'})
+        self.assertTrue(response['Location'].startswith('https://cas.example.org/login'))
+        self.assertEqual(self.client.session.get('_auth_user_id'), None)
+
+
+    def test_middleware_signs_out_revoked_user(self):
+        self.client.get('/login/')
+        del self.client.cookies[settings.CAS_ASSERTION_COOKIE_NAME]
+        assertions.revoke_user('alice')
+        self.client.get('/login/')
+        self.assertEqual(self.client.session.get('_auth_user_id'), None)
+
+
+    def test_middleware_keeps_valid_session(self):
+        self.client.get('/login/')
+        assertions.revoke('ST-2')
+        self.client.get('/login/')
+        self.assertEqual(self.client.session.get('_auth_user_id'), self.user.pk)
+
+
+class AssertionConfigurationTests(TestCase):
+
+    def assertImproperlyConfigured(self, **settings):
+        with override_settings(CAS_ASSERTION_KEY='assertion key', **settings):
+            self.assertRaises(ImproperlyConfigured, assertions.issue, 'alice', [], [], 'ST-1')
+            self.assertRaises(ImproperlyConfigured, assertions.revoke, 'ST-1')
+            self.assertRaises(ImproperlyConfigured, assertions.revoke_user, 'alice')
+
+
+    def test_without_cache_backend(self):
+        self.assertImproperlyConfigured(CAS_CACHE_BACKEND=None)
+
+
+    def test_with_locmem_cache_backend(self):
+        self.assertImproperlyConfigured(
+            CAS_CACHE_BACKEND='django_cas',
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'django_cas': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+
+
+    def test_with_dummy_cache_backend(self):
+        self.assertImproperlyConfigured(
+            CAS_CACHE_BACKEND='django_cas',
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'django_cas': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
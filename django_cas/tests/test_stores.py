@@ -0,0 +1,79 @@
+""" Tests of the ticket stores, see django_cas.stores """
+
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_cas import stores
+from django_cas.models import PgtIOU, Tgt
+
+__all__ = ['ModelTicketStoreTests', 'ModelTicketStoreFallbackTests']
+
+
+@override_settings(CAS_TGT_CACHE_TIMEOUT=0)
+class ModelTicketStoreTests(TestCase):
+    """ Runs with the single statement upsert where the database supports it """
+
+    def setUp(self):
+        self.store = stores.ModelTicketStore()
+
+
+    def test_consume_inserts_tgt(self):
+        self.store.store_pgtiou('PGTIOU-1', 'PGT-1')
+        self.assertEqual(self.store.consume_pgtiou('PGTIOU-1', 'alice'), 'PGT-1')
+        self.assertEqual(Tgt.objects.get(username='alice').tgt, 'PGT-1')
+        self.assertFalse(PgtIOU.objects.filter(pgtIou='PGTIOU-1').exists())
+
+
+    def test_consume_updates_tgt(self):
+        self.store.store_pgtiou('PGTIOU-1', 'PGT-1')
+        self.store.store_pgtiou('PGTIOU-2', 'PGT-2')
+        self.store.consume_pgtiou('PGTIOU-1', 'alice')
+        self.assertEqual(self.store.consume_pgtiou('PGTIOU-2', 'alice'), 'PGT-2')
+        self.assertEqual(list(Tgt.objects.filter(username='alice').values_list('tgt', flat=True)),
+                         ['PGT-2'])
+
+
+    def test_consume_replayed_iou(self):
+        self.store.store_pgtiou('PGTIOU-1', 'PGT-1')
+        self.store.consume_pgtiou('PGTIOU-1', 'alice')
+        self.assertEqual(self.store.consume_pgtiou('PGTIOU-1', 'alice'), None)
+        self.assertEqual(self.store.consume_pgtiou('PGTIOU-1', 'bob'), None)
+        self.assertEqual(Tgt.objects.get(username='alice').tgt, 'PGT-1')
+        self.assertFalse(Tgt.objects.filter(username='bob').exists())
+
+
+    def test_set_tgt(self):
+        self.store.set_tgt('alice', 'PGT-1')
+        self.store.set_tgt('alice', 'PGT-2')
+        self.assertEqual(self.store.get_tgt('alice').tgt, 'PGT-2')
+        self.assertEqual(Tgt.objects.filter(username='alice').count(), 1)
+
+
+class ModelTicketStoreFallbackTests(ModelTicketStoreTests):
+    """ Runs with the update or insert in a savepoint of databases without upsert """
+
+    def setUp(self):
+        super(ModelTicketStoreFallbackTests, self).setUp()
+        self.upsert_sql, self.consume_sql = stores._upsert_sql, stores._consume_sql
+        stores._upsert_sql = stores._consume_sql = lambda connection: None
+
+
+    def tearDown(self):
+        stores._upsert_sql, stores._consume_sql = self.upsert_sql, self.consume_sql
+
+
+    def test_concurrent_insert(self):
+        # The Tgt is inserted by another thread between the update and the insert.
+        Tgt.objects.create(username='alice', tgt='PGT-1')
+        update = QuerySet.update
+        updates = []
+        def racing_update(queryset, **kwargs):
+            updates.append(kwargs)
+            return 0 if len(updates) == 1 else update(queryset, **kwargs)
+        QuerySet.update = racing_update
+        try:
+            self.store.set_tgt('alice', 'PGT-2')
+        finally:
+            QuerySet.update = update
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(Tgt.objects.get(username='alice').tgt, 'PGT-2')
@@ -0,0 +1,6 @@
+from django.conf.urls import patterns
+
+urlpatterns = patterns('',
+    (r'^login/$', 'django_cas.views.login'),
+    (r'^logout/$', 'django_cas.views.logout'),
+)
@@ -0,0 +1,308 @@
+""" Django CAS 2.0 HTTP transport used for all calls to the CAS server
+
+    Calls go through a circuit breaker, which stops calling the CAS server for
+    a while after repeated failures, so that an unresponsive CAS server does
+    not tie up every worker waiting for it.
+"""
+
+from django.conf import settings
+from django_cas import metrics
+from django_cas.conf import import_by_path, resolve
+from django_cas.exceptions import CasServerUnavailable
+from urllib import urlencode
+from urlparse import urljoin, urlsplit
+import httplib
+import logging
+import os
+import socket
+import threading
+import time
+import urllib2
+
+__all__ = ['CircuitBreaker', 'TRANSPORT_ERRORS', 'cas_unavailable', 'fetch', 'get_breaker',
+           'get_transport', 'PooledTransport', 'UrllibTransport']
+
+logger = logging.getLogger(__name__)
+
+# Exceptions raised by the transports when the CAS server cannot be reached,
+# times out or responds with HTTP 5xx.
+TRANSPORT_ERRORS = (socket.error, urllib2.URLError, httplib.HTTPException)
+
+
+class UrllibTransport(object):
+    """ Transport opening a new connection for every call to the CAS server.
+
+        This is how django_cas always did it before the pooled transport was
+        introduced. It is kept for environments where persistent connections
+        to the CAS server are not wanted, e.g. behind some load balancers.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, pool_size=None):
+        self.timeout = read_timeout or connect_timeout
+
+
+    def get(self, url):
+        """ Returns the body of the response to a GET request for url """
+        if self.timeout:
+            page = urllib2.urlopen(url, timeout=self.timeout)
+        else:
+            page = urllib2.urlopen(url)
+        try:
+            return page.read()
+        finally:
+            page.close()
+
+
+class PooledTransport(object):
+    """ Transport keeping a bounded pool of persistent (keep-alive) connections
+        per CAS server host, so that ticket validations and proxy ticket requests
+        reuse warm connections instead of doing a TCP and TLS handshake each time.
+
+        Connections are handed out exclusively to one thread at a time. At most
+        pool_size idle connections are kept per host, connections in excess of
+        that are closed when returned to the pool.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, pool_size=10):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._pid = os.getpid()
+
+
+    def get(self, url):
+        """ Returns the body of the response to a GET request for url """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if query:
+            path = path + '?' + query
+        key = (scheme, netloc)
+
+        conn, reused = self._acquire(key)
+        try:
+            response = self._request(conn, path, reused)
+        except:
+            conn.close()
+            raise
+        if response is None:
+            # The server closed the idle connection, retry once on a new one.
+            conn.close()
+            logger.debug("Pooled connection to %s was closed, retrying on a new connection", netloc)
+            conn = self._connect(key)
+            try:
+                response = self._request(conn, path)
+            except:
+                conn.close()
+                raise
+
+        try:
+            body = response.read()
+        except:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        if response.status >= 500:
+            raise httplib.HTTPException("CAS server responded with HTTP status %s for %s"
+                                        % (response.status, path))
+        if response.status != httplib.OK:
+            logger.warn("CAS server responded with HTTP status %s for %s", response.status, path)
+        return body
+
+
+    def close(self):
+        """ Closes all idle connections in the pool """
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+
+    def _request(self, conn, path, reused=False):
+        """ Returns the response to a GET request for path on conn, or None if
+            conn was reused and turns out to have been closed by the server
+            before the request was sent or answered.
+
+            Timeouts and failures once the request may have been processed are
+            never reported as a closed connection, since retrying them would
+            wait for the server twice, or send a ticket validation twice.
+        """
+        if conn.sock is None:
+            conn.connect()
+            if self.read_timeout:
+                conn.sock.settimeout(self.read_timeout)
+        try:
+            conn.request('GET', path, headers={'Connection': 'keep-alive'})
+        except socket.error as e:
+            if reused and not isinstance(e, socket.timeout):
+                return None
+            raise
+        try:
+            return conn.getresponse()
+        except httplib.BadStatusLine:
+            # The connection was closed without a valid response.
+            if reused:
+                return None
+            raise
+
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.connect_timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.connect_timeout)
+
+
+    def _acquire(self, key):
+        """ Returns a tuple (connection, reused) """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections must not be shared with a parent process after fork.
+                self._pools, self._pid = {}, os.getpid()
+            idle = self._pools.get(key)
+            if idle:
+                return (idle.pop(), True)
+        return (self._connect(key), False)
+
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._pools.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+
+class CircuitBreaker(object):
+    """ Circuit breaker for calls to the CAS server.
+
+        After failure_threshold consecutive failed calls the breaker opens, and
+        calls fail at once with CasServerUnavailable for reset_timeout seconds.
+        The first call after that is let through as a probe, while others still
+        fail. The breaker closes if the probe succeeds and opens again if not.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+
+
+    def call(self, func, *args):
+        """ Returns func(*args) unless the breaker is open """
+        self._before()
+        try:
+            result = func(*args)
+        except Exception:
+            self._failed()
+            raise
+        self._succeeded()
+        return result
+
+
+    def is_open(self):
+        """ Returns True if calls currently fail without calling the CAS server """
+        return self.retry_after() > 0 or self._probing
+
+
+    def retry_after(self):
+        """ Returns the number of seconds until the open breaker lets a probe through """
+        opened = self._opened
+        if opened is None:
+            return 0
+        return max(0, opened + self.reset_timeout - time.time())
+
+
+    def _before(self):
+        with self._lock:
+            if self._opened is None:
+                return
+            retry_after = self._opened + self.reset_timeout - time.time()
+            if retry_after > 0 or self._probing:
+                metrics.incr('breaker.rejected')
+                raise CasServerUnavailable("CAS server unavailable, not calling it",
+                                           max(0, retry_after))
+            logger.info("Probing CAS server")
+            self._probing = True
+
+
+    def _failed(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened is None:
+                    logger.error("CAS server failed %d times, not calling it for %s seconds",
+                                 self._failures, self.reset_timeout)
+                    metrics.incr('breaker.opened')
+                self._opened = time.time()
+                self._probing = False
+
+
+    def _succeeded(self):
+        with self._lock:
+            if self._opened is not None:
+                logger.info("CAS server available again")
+                metrics.incr('breaker.closed')
+            self._failures = 0
+            self._opened = None
+            self._probing = False
+
+
+def get_breaker():
+    """ Returns the circuit breaker of the process configured by CAS_BREAKER_THRESHOLD
+        and CAS_BREAKER_RESET_TIMEOUT, or None if disabled.
+    """
+    def create_breaker():
+        if not settings.CAS_BREAKER_THRESHOLD:
+            return None
+        return CircuitBreaker(settings.CAS_BREAKER_THRESHOLD, settings.CAS_BREAKER_RESET_TIMEOUT)
+    return resolve('breaker', create_breaker)
+
+
+def cas_unavailable():
+    """ Returns True if calls to the CAS server fail at once, since the circuit
+        breaker is open.
+    """
+    breaker = get_breaker()
+    return breaker is not None and breaker.is_open()
+
+
+def get_transport():
+    """ Returns the transport configured by CAS_TRANSPORT, shared by the process """
+    def create_transport():
+        transport_class = import_by_path(settings.CAS_TRANSPORT)
+        return transport_class(connect_timeout=settings.CAS_CONNECT_TIMEOUT,
+                               read_timeout=settings.CAS_READ_TIMEOUT,
+                               pool_size=settings.CAS_POOL_SIZE)
+    return resolve('transport', create_transport)
+
+
+def fetch(endpoint, params):
+    """ Calls endpoint, e.g. 'proxyValidate', relative to CAS_SERVER_URL with
+        the given query parameters and returns the body of the response.
+
+        Raises CasServerUnavailable while the circuit breaker is open.
+    """
+    url = urljoin(settings.CAS_SERVER_URL, endpoint) + '?' + urlencode(params)
+    breaker = get_breaker()
+    if breaker is None:
+        return _get(endpoint, url)
+    return breaker.call(_get, endpoint, url)
+
+
+def _get(endpoint, url):
+    with metrics.timer('request.' + endpoint):
+        try:
+            return get_transport().get(url)
+        except Exception:
+            metrics.incr('request.%s.errors' % endpoint)
+            raise
@@ -0,0 +1,88 @@
+""" Django CAS 2.0 building of login, logout and service URLs
+
+    The parts of the URLs given by settings are computed once per process,
+    only the parts given by the request are encoded for each request.
+"""
+
+from django.conf import settings
+from django.contrib.auth import REDIRECT_FIELD_NAME
+from django_cas.conf import resolve
+from urllib import quote_plus, urlencode
+from urlparse import urljoin
+
+__all__ = ['URLBuilder', 'get_url_builder']
+
+
+def _quote(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return quote_plus(value)
+
+
+class URLBuilder(object):
+    """ Builds CAS URLs with parts precomputed from the current settings """
+
+    def __init__(self):
+        params = {}
+        if settings.CAS_RENEW:
+            params.update({'renew': 'true'})
+        elif settings.CAS_GATEWAY:
+            params.update({'gateway': 'true'})
+        if settings.CAS_EXTRA_LOGIN_PARAMS:
+            params.update(settings.CAS_EXTRA_LOGIN_PARAMS)
+
+        login = urljoin(settings.CAS_SERVER_URL, 'login') + '?'
+        if 'service' in params:
+            # The service is fixed by CAS_EXTRA_LOGIN_PARAMS.
+            self._login_fixed = login + urlencode(params)
+        else:
+            self._login_fixed = None
+            self._login_prefix = login + 'service='
+            self._login_suffix = '&' + urlencode(params) if params else ''
+
+        self._logout = urljoin(settings.CAS_SERVER_URL, 'logout')
+        self._logout_prefix = self._logout + '?url='
+        self._gateway = (urlencode({settings.CAS_GATEWAY_PARAM: '1'})
+                         if settings.CAS_GATEWAY else None)
+        self._next_prefix = REDIRECT_FIELD_NAME + '='
+        self._admin_login_prefix = settings.LOGIN_URL + '?' + REDIRECT_FIELD_NAME + '='
+
+
+    def service_url(self, service, redirect_to):
+        """ Returns the application service URL for CAS for service, the URL
+            of the login view, redirecting to redirect_to after login.
+        """
+        params = []
+        if self._gateway:
+            params.append(self._gateway)
+        if redirect_to:
+            params.append(self._next_prefix + _quote(redirect_to))
+        if not params:
+            return service
+        return ''.join([service,
+                        '?' if not '?' in service else '&',
+                        '&'.join(params)])
+
+
+    def login_url(self, service):
+        """ Returns the CAS login URL for service """
+        if self._login_fixed:
+            return self._login_fixed
+        return self._login_prefix + _quote(service) + self._login_suffix
+
+
+    def logout_url(self, next_url=None):
+        """ Returns the CAS logout URL, asking CAS to link to next_url if given """
+        if next_url:
+            return self._logout_prefix + _quote(next_url)
+        return self._logout
+
+
+    def admin_login_url(self, path):
+        """ Returns the LOGIN_URL, redirecting to path after login """
+        return self._admin_login_prefix + _quote(path)
+
+
+def get_url_builder():
+    """ Returns the URL builder for the current settings """
+    return resolve('url_builder', URLBuilder)
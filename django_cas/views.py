@@ -4,14 +4,18 @@ from django.conf import settings
 from django.contrib import auth
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseRedirect, HttpResponse, Http404
-from django_cas.models import PgtIOU, SessionServiceTicket
-from urllib import urlencode
-from urlparse import urljoin
-from xml.dom import minidom
+from django_cas import assertions, metrics, rendezvous, signout
+from django_cas.exceptions import CasServerUnavailable
+from django_cas.models import SessionServiceTicket
+from django_cas.response import parse_logout_request
+from django_cas.stores import get_ticket_store
+from django_cas.transport import TRANSPORT_ERRORS, cas_unavailable, get_breaker
+from django_cas.urlbuilder import get_url_builder
 import logging
+import math
 import types
 
-__all__ = ['login', 'logout', 'proxy_callback']
+__all__ = ['login', 'logout', 'metrics_view', 'proxy_callback', 'service_unavailable']
 
 logger = logging.getLogger(__name__)
 
@@ -31,20 +35,7 @@ def _service(request):
 def _service_url(request, redirect_to):
     """ Returns application service URL for CAS. """
     
-    service = _service(request) + request.path
-
-    params = {}
-    if settings.CAS_GATEWAY:
-        params.update({settings.CAS_GATEWAY_PARAM: '1'})
-    if redirect_to:
-        params.update({auth.REDIRECT_FIELD_NAME: redirect_to})
-
-    if not params:
-        return service
-    else:
-        return ''.join([service,
-                        '?' if not '?' in service else '&',
-                        urlencode(params)])
+    return get_url_builder().service_url(_service(request) + request.path, redirect_to)
 
 
 def _redirect_url(request):
@@ -62,36 +53,84 @@ def _redirect_url(request):
 def _login_url(service):
     """ Returns a CAS login URL. """
 
-    params = {'service': service}
-    if settings.CAS_RENEW:
-        params.update({'renew': 'true'})
-    elif settings.CAS_GATEWAY:
-        params.update({'gateway': 'true'})
-    if settings.CAS_EXTRA_LOGIN_PARAMS:
-        params.update(settings.CAS_EXTRA_LOGIN_PARAMS)
-    return urljoin(settings.CAS_SERVER_URL, 'login') + '?' + urlencode(params)
+    return get_url_builder().login_url(service)
 
 
 def _logout_url(request, next_page):
     """ Returns a CAS logout URL """
 
-    logout_url = urljoin(settings.CAS_SERVER_URL, 'logout')
     if next_page:
-        logout_url += '?' + urlencode({'url': _service(request) + next_page})
-
-    return logout_url
+        return get_url_builder().logout_url(_service(request) + next_page)
+    return get_url_builder().logout_url()
 
 
 def _single_sign_out(request):
-    single_sign_out_request = request.POST.get('logoutRequest')
-    request.session = _get_session(single_sign_out_request)
-    request.user = auth.get_user(request)
-    logger.debug("Got single sign out callback from CAS for user %s session %s", 
-                 request.user, request.session.session_key)
-    auth.logout(request)
+    with metrics.timer('signout'):
+        return _process_single_sign_out(request)
+
+
+def _process_single_sign_out(request):
+    ticket = _get_logout_ticket(request.POST.get('logoutRequest'))
+    if settings.CAS_ASSERTION_KEY:
+        assertions.revoke(ticket)
+    if settings.CAS_SINGLE_SIGN_OUT_ASYNC or settings.CAS_SINGLE_SIGN_OUT_FAST:
+        return _direct_single_sign_out(ticket)
+    for session in _get_sessions(ticket):
+        request.session = session
+        request.user = auth.get_user(request)
+        logger.debug("Got single sign out callback from CAS for user %s session %s", 
+                     request.user, request.session.session_key)
+        auth.logout(request)
+    return HttpResponse()
+
+
+def _get_logout_ticket(logout_request):
+    """ Returns the service ticket of a single sign out request """
+    try:
+        with metrics.timer('parse.logout'):
+            ticket = parse_logout_request(logout_request)
+    except Exception as e:
+        logger.error("Unable to parse logout response from server: %s", e)
+        raise Http404
+    if not ticket:
+        raise Http404
+    return ticket
+
+
+def _direct_single_sign_out(ticket):
+    """ Deletes the session of a single sign out request directly from the
+        session engine, without loading the user, or queues it for deletion
+        by a background thread if CAS_SINGLE_SIGN_OUT_ASYNC is set.
+    """
+    if settings.CAS_SINGLE_SIGN_OUT_ASYNC:
+        logger.debug("Queued single sign out callback from CAS for ticket %s", ticket)
+        signout.enqueue(ticket)
+    elif not signout.sign_out_tickets([ticket]):
+        raise Http404
     return HttpResponse()
 
     
+def service_unavailable(exception):
+    """ Returns a 503 response for CasServerUnavailable or a transport error """
+    retry_after = getattr(exception, 'retry_after', None)
+    if retry_after is None:
+        breaker = get_breaker()
+        retry_after = breaker.retry_after() if breaker is not None else 0
+    response = HttpResponse("The CAS server is unavailable, please try again later.", status=503)
+    response['Retry-After'] = str(int(math.ceil(retry_after)) or 1)
+    return response
+
+
+def _get_assertion(request):
+    """ Returns the assertion cookie of the request, if assertions are enabled
+        and CAS_RENEW does not require users to authenticate with CAS again.
+    """
+
+    if settings.CAS_ASSERTION_KEY and not settings.CAS_RENEW:
+        return request.COOKIES.get(settings.CAS_ASSERTION_COOKIE_NAME)
+    return None
+
+
 def login(request):
     """ Forwards to CAS login URL or verifies CAS ticket. """
 
@@ -110,13 +149,38 @@ def login(request):
         raise PermissionDenied()
     
     if not ticket:
+        assertion = _get_assertion(request)
+        if assertion:
+            user = auth.authenticate(assertion=assertion)
+            if user is not None:
+                auth.login(request, user)
+                # Checked by the CASMiddleware, to sign the session out with the assertion.
+                request.session[assertions.SESSION_KEY] = assertions.reference(assertion)
+                return HttpResponseRedirect(next_page)
+        if settings.CAS_GATEWAY and cas_unavailable():
+            # Fail like a gateway login without a ticket, without a round trip to CAS.
+            raise PermissionDenied()
         return HttpResponseRedirect(_login_url(service))
    
-    user = auth.authenticate(ticket=ticket, service=service)
+    try:
+        user = auth.authenticate(ticket=ticket, service=service)
+    except (CasServerUnavailable,) + TRANSPORT_ERRORS as e:
+        logger.warn("Could not verify ticket %s: %s", ticket, e)
+        if settings.CAS_RETRY_LOGIN:
+            return HttpResponseRedirect(_login_url(service))
+        if settings.CAS_GATEWAY:
+            raise PermissionDenied()
+        return service_unavailable(e)
 
     if user is not None:
         auth.login(request, user)
-        return HttpResponseRedirect(next_page)
+        response = HttpResponseRedirect(next_page)
+        if getattr(user, 'cas_assertion', None):
+            response.set_cookie(settings.CAS_ASSERTION_COOKIE_NAME, user.cas_assertion,
+                                max_age=settings.CAS_ASSERTION_MAX_AGE,
+                                domain=settings.CAS_ASSERTION_COOKIE_DOMAIN,
+                                secure=request.is_secure(), httponly=True)
+        return response
     
     if settings.CAS_RETRY_LOGIN:
         return HttpResponseRedirect(_login_url(service))
@@ -124,19 +188,18 @@ def login(request):
     raise PermissionDenied("Login failed")
  
 
-def _get_session(logout_response):
-    """ Recovers the session mapped with the CAS service ticket
+def _get_sessions(ticket):
+    """ Recovers the sessions mapped with the CAS service ticket
         received in the SAML CAS response at CAS logout.
     """
     try:
-        response = minidom.parseString(logout_response)
-        ticket = response.getElementsByTagName('samlp:SessionIndex')[0].firstChild.nodeValue
-        sst = SessionServiceTicket.objects.get(pk=ticket)
-        return sst.get_session()
-    except SessionServiceTicket.DoesNotExist:
-        logger.info("No session matching single sign out request: %s", ticket)        
+        session_keys = get_ticket_store().get_session_keys(ticket)
+        if session_keys:
+            return [SessionServiceTicket(service_ticket=ticket, session_key=session_key).get_session()
+                    for session_key in session_keys]
+        logger.info("No session matching single sign out request: %s", ticket)
     except Exception as e:
-        logger.error("Unable to parse logout response from server: %s", e)
+        logger.error("Unable to recover session for single sign out request: %s", e)
     raise Http404
 
 
@@ -146,11 +209,15 @@ def logout(request):
     auth.logout(request)
     next_page = _redirect_url(request)
     if settings.CAS_LOGOUT_COMPLETELY:
-        return HttpResponseRedirect(_logout_url(request, next_page))
+        response = HttpResponseRedirect(_logout_url(request, next_page))
     else:
         # This is in most cases pointless if not CAS_RENEW is set. The user will 
         # simply be logged in again on next request requiring authorization.
-        return HttpResponseRedirect(next_page)
+        response = HttpResponseRedirect(next_page)
+    if settings.CAS_ASSERTION_KEY and settings.CAS_ASSERTION_COOKIE_NAME in request.COOKIES:
+        response.delete_cookie(settings.CAS_ASSERTION_COOKIE_NAME,
+                               domain=settings.CAS_ASSERTION_COOKIE_DOMAIN)
+    return response
 
 
 def proxy_callback(request):
@@ -167,5 +234,19 @@ def proxy_callback(request):
     if not (pgtIou and tgt):
         return HttpResponse()
 
-    PgtIOU.objects.create(tgt = tgt, pgtIou = pgtIou)
+    get_ticket_store().store_pgtiou(pgtIou, tgt)
+    rendezvous.notify(pgtIou, settings.CAS_PGT_WAIT_TIMEOUT)
     return HttpResponse()
+
+
+def metrics_view(request):
+    """ Returns the metrics of this process in the Prometheus text format,
+        when using the MemoryMetrics sink, with the sizes of the ticket tables
+        if CAS_METRICS_TABLE_SIZES is set.
+    """
+    sink = metrics.get_metrics()
+    if not hasattr(sink, 'render'):
+        raise Http404
+    if settings.CAS_METRICS_TABLE_SIZES:
+        metrics.record_table_sizes()
+    return HttpResponse(sink.render(), content_type='text/plain; version=0.0.4')